@@ -1,7 +1,83 @@
-from tkinter import ttk, Tk, PhotoImage, Canvas, filedialog, colorchooser, messagebox, RIDGE, GROOVE, ROUND, Scale, HORIZONTAL
-import cv2
-from PIL import ImageTk, Image
-import numpy as np
+import importlib
+import json
+import os
+import sys
+import threading
+import time
+from tkinter import ttk, Tk, PhotoImage, Canvas, filedialog, colorchooser, messagebox, RIDGE, GROOVE, NW, Scale, HORIZONTAL
+from functools import partial
+import filters
+import tracing
+from render import RenderScheduler
+from strokes import Stroke
+
+# Headless commands: `python app.py <command> ...` runs the module's main()
+COMMANDS = {
+    'batch': 'batch',
+    'bench': 'bench',
+    'check-parallel': 'parallel',
+    'check-blur': 'blur',
+    'clip': 'frames',
+    'startup': 'startup',
+}
+
+
+# OpenCV, numpy and Pillow take most of the start-up time, so they and the modules built on
+# them are imported on a background thread once the window is up (see FrontEnd.finish_startup)
+def import_modules():
+    global cv2, np, Image, ImageTk, export, frames, pipeline
+    global ResultCache, History, SnapshotStore, ImageLoader, PyramidCache, Viewport
+    import cv2
+    import numpy as np
+    from PIL import ImageTk, Image
+    import export
+    import frames
+    import pipeline
+    from cache import ResultCache
+    from history import History, SnapshotStore
+    from loader import ImageLoader
+    from viewport import PyramidCache, Viewport
+    # Plugins too, so the Filters panel opens at once
+    filters.load()
+
+
+# Main menu: the label of each button and the FrontEnd method it calls, looked up on click
+MENU = [
+    ("Upload An Image", 'upload_action'),
+    ("Crop Image", 'crop_action'),
+    ("Add Text", 'text_action_1'),
+    ("Draw Over Image", 'draw_action'),
+    ("Apply Filters", 'filter_action'),
+    ("Blur/Smoothening", 'blur_action'),
+    ("Adjust Levels", 'adjust_action'),
+    ("Rotate", 'rotate_action'),
+    ("Flip", 'flip_action'),
+    ("Save As", 'save_action'),
+    ("Export", 'export_action'),
+    ("Frames", 'frames_action'),
+]
+
+# With EDITOR_STARTUP_PROBE=1 the editor prints when its window appeared and when it was
+# ready, then quits; `python app.py startup` runs it this way
+STARTUP_PROBE = os.environ.get('EDITOR_STARTUP_PROBE') == '1'
+
+# Canvas handlers timed along with every *_action method when tracing is on
+TRACED_HANDLERS = ('start_crop', 'crop', 'end_crop', 'end_text_crop', 'start_draw', 'draw',
+                   'end_draw', 'pan_view', 'show_first_paint', 'show_loaded_image', 'show_preview',
+                   'commit_image', 'filter_resolved', 'show_history', 'show_frame', 'display_image')
+
+# Undo history: snapshot memory budget, snapshot interval and optional compression/disk spill
+HISTORY_BUDGET_MB = int(os.environ.get('EDITOR_HISTORY_MB', 512))
+HISTORY_INTERVAL = int(os.environ.get('EDITOR_HISTORY_INTERVAL', 5))
+HISTORY_COMPRESS = os.environ.get('EDITOR_HISTORY_COMPRESS') == '1'
+HISTORY_SPILL_DIR = os.environ.get('EDITOR_HISTORY_SPILL_DIR')
+
+# Memory budget for cached filter results and intermediates (0 turns the cache off)
+CACHE_BUDGET_MB = int(os.environ.get('EDITOR_CACHE_MB', 256))
+
+# Images above this size are kept in memory-mapped scratch files and processed in tiles
+TILED_MEGAPIXELS = float(os.environ.get('EDITOR_TILED_MP', 64))
+
 
 class FrontEnd:
     def __init__(self, master):
@@ -9,12 +85,91 @@ class FrontEnd:
         self.original_image = None
         self.edited_image = None
         self.filtered_image = None
+        self.preview_image = None  # Display-resolution proxy of edited_image
+        self.preview_scale = 1
+        self.pending_filter = None  # Step not yet rendered at full resolution
+        self.resolving = None  # While it renders, what to do with the result
+        self.filtered_steps = []  # Steps turning edited_image into filtered_image
+        self.history = None  # Applied changes since the image was loaded
         self.filename = None
-        self.ratio = 1
+        self.clip = None  # Scrubbing frames of an animated GIF or video
+        self.shown = None  # Pyramid of the image on the canvas
         self.color_code = ((255, 0, 0), '#ff0000')  # Default color: red
         self.text_extracted = "hello"  # Default text
         self.font_size = 2  # Default font size
+        self.brush_size = 2  # Brush width in canvas pixels
+        self.brush_opacity = 1
+        self.stroke = None
+        self.status_text = "No image loaded"
+        self.rendering = False
+        self.renderer = RenderScheduler(master, on_busy=self.set_rendering)
+        self.loader = None  # Set with the other objects that need OpenCV, see finish_startup
+        self.load_started = None
+        self.export_job = None
+        self.export_sizes = "2048,1024,512"  # Longest side of each web-sized JPEG
+        self.first_paint_seconds = None
+        if tracing.TRACER.enabled:
+            self.instrument()
         self.menu_initialisation()
+        self.master.bind("<Control-z>", lambda event: self.undo_action())
+        self.master.bind("<Control-y>", lambda event: self.redo_action())
+        self.master.bind("<Control-t>", lambda event: self.export_trace_action())
+        self.master.bind("<Control-k>", lambda event: self.cache_stats_action())
+        self.master.bind("<Control-0>", lambda event: self.fit_view_action())
+        self.started = time.time()
+        self.window_time = None
+        if STARTUP_PROBE:
+            self.master.bind("<Map>", self.record_window_time)
+        self.import_error = None
+        self.imports = threading.Thread(target=self.import_modules, name="imports", daemon=True)
+        self.master.after_idle(self.start_imports)
+
+    # Start-up
+    def start_imports(self):
+        # Idle callbacks run after Tk has drawn the window
+        if self.imports.ident is None:
+            self.imports.start()
+        self.master.after(15, self.poll_imports)
+
+    def import_modules(self):
+        try:
+            import_modules()
+        except Exception as e:
+            self.import_error = e
+
+    def poll_imports(self):
+        if self.imports.is_alive():
+            self.master.after(15, self.poll_imports)
+        else:
+            self.finish_startup()
+
+    def finish_startup(self):
+        # Creates everything that needs OpenCV, numpy or Pillow. An action that needs them
+        # before the imports are done calls this first and waits.
+        if self.loader is not None:
+            return
+        if self.imports.ident is None:
+            self.imports.start()
+        self.imports.join()
+        if self.import_error is not None:
+            raise self.import_error
+        self.history_store = SnapshotStore(HISTORY_BUDGET_MB * 1024 * 1024, compress=HISTORY_COMPRESS,
+                                           spill_dir=HISTORY_SPILL_DIR)
+        self.result_cache = ResultCache(CACHE_BUDGET_MB * 1024 * 1024)
+        self.viewport = Viewport(pipeline.DISPLAY_WIDTH, pipeline.DISPLAY_HEIGHT)
+        self.pyramids = PyramidCache()
+        self.export_quality = export.JPEG_QUALITY
+        self.export_compression = export.PNG_COMPRESSION
+        self.loader = ImageLoader(self.master)
+        if filters.errors:
+            self.set_status("Filter plugins failed to load: " + "; ".join(filters.errors))
+        if STARTUP_PROBE:
+            print(json.dumps({'started': self.started, 'window': self.window_time, 'ready': time.time()}), flush=True)
+            self.master.after_idle(self.master.destroy)
+
+    def record_window_time(self, event):
+        if self.window_time is None and event.widget is self.master:
+            self.window_time = time.time()
 
     def menu_initialisation(self):
         self.master.geometry('800x700+250+10')
@@ -36,23 +191,18 @@ class FrontEnd:
         self.frame_menu.pack(pady=10)
         self.frame_menu.config(relief=RIDGE, padding=(50, 15))
 
-        buttons = [
-            ("Upload An Image", self.upload_action),
-            ("Crop Image", self.crop_action),
-            ("Add Text", self.text_action_1),
-            ("Draw Over Image", self.draw_action),
-            ("Apply Filters", self.filter_action),
-            ("Blur/Smoothening", self.blur_action),
-            ("Adjust Levels", self.adjust_action),
-            ("Rotate", self.rotate_action),
-            ("Flip", self.flip_action),
-            ("Save As", self.save_action)
-        ]
-        for i, (text, command) in enumerate(buttons):
-            ttk.Button(self.frame_menu, text=text, command=command).grid(row=i, column=0, padx=5, pady=5, sticky='sw')
+        for i, (text, name) in enumerate(MENU):
+            ttk.Button(self.frame_menu, text=text, command=lambda name=name: getattr(self, name)()).grid(
+                row=i, column=0, padx=5, pady=5, sticky='sw')
 
         self.canvas = Canvas(self.frame_menu, bg="gray", width=300, height=400)
         self.canvas.grid(row=0, column=1, rowspan=10, padx=10)
+        # Mouse wheel zooms around the pointer, dragging with the right button pans
+        self.canvas.bind("<MouseWheel>", self.zoom_action)
+        self.canvas.bind("<Button-4>", self.zoom_action)
+        self.canvas.bind("<Button-5>", self.zoom_action)
+        self.canvas.bind("<ButtonPress-3>", self.start_pan)
+        self.canvas.bind("<B3-Motion>", self.pan_view)
 
         # Footer Menu
         self.apply_and_cancel = ttk.Frame(self.master)
@@ -60,27 +210,82 @@ class FrontEnd:
         ttk.Button(self.apply_and_cancel, text="Apply", command=self.apply_action).grid(row=0, column=0, padx=5, pady=5)
         ttk.Button(self.apply_and_cancel, text="Cancel", command=self.cancel_action).grid(row=0, column=1, padx=5, pady=5)
         ttk.Button(self.apply_and_cancel, text="Revert All Changes", command=self.revert_action).grid(row=0, column=2, padx=5, pady=5)
+        ttk.Button(self.apply_and_cancel, text="Undo", command=self.undo_action).grid(row=0, column=3, padx=5, pady=5)
+        ttk.Button(self.apply_and_cancel, text="Redo", command=self.redo_action).grid(row=0, column=4, padx=5, pady=5)
+        ttk.Button(self.apply_and_cancel, text="Save Recipe", command=self.save_recipe_action).grid(row=0, column=5, padx=5, pady=5)
 
         # Status Label
         self.status_label = ttk.Label(self.master, text="No image loaded", relief=GROOVE)
         self.status_label.pack(fill='x', pady=5)
+        self.progress_bar = ttk.Progressbar(self.master, mode='determinate', maximum=1)
 
     # Main Menu Actions
     def upload_action(self):
+        self.finish_startup()
         self.canvas.delete("all")
-        self.filename = filedialog.askopenfilename(filetypes=[("Image files", "*.png *.jpg *.jpeg *.bmp *.gif")])
+        clip_types = ' '.join('*' + extension for extension in frames.CLIP_EXTENSIONS)
+        self.filename = filedialog.askopenfilename(filetypes=[("Images and clips", "*.png *.jpg *.jpeg *.bmp " + clip_types),
+                                                              ("Image files", "*.png *.jpg *.jpeg *.bmp *.gif"),
+                                                              ("Animations and video", clip_types)])
         if self.filename:
-            self.original_image = cv2.imread(self.filename)
-            if self.original_image is None:
-                messagebox.showerror("Error", "Failed to load image. Please select a valid image file.")
-                self.status_label.config(text="No image loaded")
-                return
-            self.edited_image = self.original_image.copy()
-            self.filtered_image = self.original_image.copy()
-            self.display_image(self.edited_image)
-            self.status_label.config(text=f"Loaded: {self.filename.split('/')[-1]}")
+            self.renderer.cancel('preview')
+            self.renderer.cancel('apply')
+            self.renderer.cancel('history')
+            # Nothing can be edited until the full image has arrived
+            self.original_image = None
+            self.edited_image = None
+            self.filtered_image = None
+            self.history = None
+            if self.clip is not None:
+                self.clip.cancel()
+                self.clip = None
+            self.reset_preview()
+            self.pyramids.clear()
+            self.viewport.clear()
+            self.shown = None
+            self.load_started = time.perf_counter()
+            self.first_paint_seconds = None
+            self.loader.load(self.filename, TILED_MEGAPIXELS * 1e6, (self.viewport.max_width, self.viewport.max_height),
+                             self.show_first_paint, self.show_loaded_image, self.load_failed)
+            self.set_status(f"Loading: {self.filename.split('/')[-1]}")
         else:
-            self.status_label.config(text="No image loaded")
+            self.set_status("No image loaded")
+
+    def show_first_paint(self, result):
+        image, scale, size = result
+        self.display_image(image, scale, size)
+        self.record_first_paint()
+
+    def record_first_paint(self):
+        end = time.perf_counter()
+        self.first_paint_seconds = end - self.load_started
+        if tracing.TRACER.enabled:
+            tracing.TRACER.record('load.first_pixel', self.load_started, end)
+
+    def show_loaded_image(self, result):
+        self.original_image, decode_seconds, clip = result
+        if self.original_image is None:
+            self.load_failed(None)
+            return
+        # Operations never modify their input, so the three images can share one buffer
+        self.edited_image = self.original_image
+        self.filtered_image = self.original_image
+        self.history = History(self.original_image, self.history_store, interval=HISTORY_INTERVAL)
+        self.display_image(self.edited_image)
+        if self.first_paint_seconds is None:
+            self.record_first_paint()
+        status = (f"Loaded: {self.filename.split('/')[-1]} (first paint {self.first_paint_seconds * 1000:.0f} ms, "
+                  f"full decode {decode_seconds:.2f} s)")
+        if clip is not None:
+            self.clip = clip
+            status += f", {self.clip.count} frames: edits apply to every frame"
+        self.set_status(status)
+
+    def load_failed(self, error):
+        self.canvas.delete("all")
+        self.shown = None
+        messagebox.showerror("Error", "Failed to load image. Please select a valid image file.")
+        self.set_status("No image loaded")
 
     def text_action_1(self):
         if self.original_image is None:
@@ -109,9 +314,9 @@ class FrontEnd:
         self.crop_start_y = 0
         self.crop_end_x = 0
         self.crop_end_y = 0
-        self.canvas.bind("<ButtonPress>", self.start_crop)
+        self.canvas.bind("<ButtonPress-1>", self.start_crop)
         self.canvas.bind("<B1-Motion>", self.crop)
-        self.canvas.bind("<ButtonRelease>", self.end_crop)
+        self.canvas.bind("<ButtonRelease-1>", self.end_crop)
 
     def start_crop(self, event):
         self.crop_start_x = event.x
@@ -124,31 +329,18 @@ class FrontEnd:
         self.crop_end_y = event.y
         self.rectangle_id = self.canvas.create_rectangle(self.crop_start_x, self.crop_start_y, self.crop_end_x, self.crop_end_y, width=1)
 
+    def crop_box(self):
+        # The dragged rectangle in image coordinates, whichever way it was drawn
+        start_x, start_y = self.viewport.to_image(self.crop_start_x, self.crop_start_y)
+        end_x, end_y = self.viewport.to_image(self.crop_end_x, self.crop_end_y)
+        return min(start_x, end_x), min(start_y, end_y), max(start_x, end_x), max(start_y, end_y)
+
     def end_crop(self, event):
-        if self.crop_start_x <= self.crop_end_x and self.crop_start_y <= self.crop_end_y:
-            start_x = int(self.crop_start_x * self.ratio)
-            start_y = int(self.crop_start_y * self.ratio)
-            end_x = int(self.crop_end_x * self.ratio)
-            end_y = int(self.crop_end_y * self.ratio)
-        elif self.crop_start_x > self.crop_end_x and self.crop_start_y <= self.crop_end_y:
-            start_x = int(self.crop_end_x * self.ratio)
-            start_y = int(self.crop_start_y * self.ratio)
-            end_x = int(self.crop_start_x * self.ratio)
-            end_y = int(self.crop_end_y * self.ratio)
-        elif self.crop_start_x <= self.crop_end_x and self.crop_start_y > self.crop_end_y:
-            start_x = int(self.crop_start_x * self.ratio)
-            start_y = int(self.crop_end_y * self.ratio)
-            end_x = int(self.crop_end_x * self.ratio)
-            end_y = int(self.crop_start_y * self.ratio)
-        else:
-            start_x = int(self.crop_end_x * self.ratio)
-            start_y = int(self.crop_end_y * self.ratio)
-            end_x = int(self.crop_start_x * self.ratio)
-            end_y = int(self.crop_start_y * self.ratio)
-        x = slice(start_x, end_x, 1)
-        y = slice(start_y, end_y, 1)
-        self.filtered_image = self.edited_image[y, x]
-        self.display_image(self.filtered_image)
+        start_x, start_y, end_x, end_y = self.crop_box()
+        if start_x >= end_x or start_y >= end_y:
+            self.set_status("Drag a rectangle over the image to crop it")
+            return
+        self.set_filtered_step(pipeline.make_step('crop', [start_x, start_y, end_x, end_y]))
 
     def text_action(self):
         if self.original_image is None:
@@ -159,69 +351,82 @@ class FrontEnd:
         self.crop_start_y = 0
         self.crop_end_x = 0
         self.crop_end_y = 0
-        self.canvas.bind("<ButtonPress>", self.start_crop)
+        self.canvas.bind("<ButtonPress-1>", self.start_crop)
         self.canvas.bind("<B1-Motion>", self.crop)
-        self.canvas.bind("<ButtonRelease>", self.end_text_crop)
+        self.canvas.bind("<ButtonRelease-1>", self.end_text_crop)
 
     def end_text_crop(self, event):
         if self.original_image is None:
             messagebox.showerror("Error", "Please upload an image first!")
             return
-        if self.crop_start_x <= self.crop_end_x and self.crop_start_y <= self.crop_end_y:
-            start_x = int(self.crop_start_x * self.ratio)
-            start_y = int(self.crop_start_y * self.ratio)
-            end_x = int(self.crop_end_x * self.ratio)
-            end_y = int(self.crop_end_y * self.ratio)
-        elif self.crop_start_x > self.crop_end_x and self.crop_start_y <= self.crop_end_y:
-            start_x = int(self.crop_end_x * self.ratio)
-            start_y = int(self.crop_start_y * self.ratio)
-            end_x = int(self.crop_start_x * self.ratio)
-            end_y = int(self.crop_end_y * self.ratio)
-        elif self.crop_start_x <= self.crop_end_x and self.crop_start_y > self.crop_end_y:
-            start_x = int(self.crop_start_x * self.ratio)
-            start_y = int(self.crop_end_y * self.ratio)
-            end_x = int(self.crop_end_x * self.ratio)
-            end_y = int(self.crop_start_y * self.ratio)
-        else:
-            start_x = int(self.crop_end_x * self.ratio)
-            start_y = int(self.crop_end_y * self.ratio)
-            end_x = int(self.crop_start_x * self.ratio)
-            end_y = int(self.crop_start_y * self.ratio)
+        start_x, start_y, end_x, end_y = self.crop_box()
         self.text_extracted = self.text_on_image.get() or "hello"
-        start_font = (start_x, start_y)
         r, g, b = tuple(map(int, self.color_code[0]))
-        self.filtered_image = cv2.putText(
-            self.edited_image.copy(), self.text_extracted, start_font, cv2.FONT_HERSHEY_SIMPLEX, self.font_size, (b, g, r), 5)
-        self.display_image(self.filtered_image)
+        self.set_filtered_step(pipeline.make_step('text', {
+            'text': self.text_extracted, 'position': [start_x, start_y], 'color': [b, g, r], 'font_size': self.font_size}))
 
     def draw_action(self):
         if self.original_image is None:
             messagebox.showerror("Error", "Please upload an image first!")
             return
         self.refresh_side_frame()
-        self.canvas.bind("<ButtonPress>", self.start_draw)
+        self.canvas.bind("<ButtonPress-1>", self.start_draw)
         self.canvas.bind("<B1-Motion>", self.draw)
+        self.canvas.bind("<ButtonRelease-1>", self.end_draw)
         self.draw_color_button = ttk.Button(self.side_frame, text="Pick A Color", command=self.choose_color)
         self.draw_color_button.grid(row=0, column=2, padx=5, pady=5, sticky='sw')
+        ttk.Label(self.side_frame, text="Brush Size").grid(row=1, column=2, padx=5, pady=5, sticky='sw')
+        self.brush_size_slider = Scale(self.side_frame, from_=1, to=50, orient=HORIZONTAL, command=self.update_brush_size)
+        self.brush_size_slider.set(self.brush_size)
+        self.brush_size_slider.grid(row=2, column=2, padx=5, sticky='sw')
+        ttk.Label(self.side_frame, text="Opacity").grid(row=3, column=2, padx=5, pady=5, sticky='sw')
+        self.brush_opacity_slider = Scale(self.side_frame, from_=0.05, to=1, resolution=0.05, orient=HORIZONTAL,
+                                          command=self.update_brush_opacity)
+        self.brush_opacity_slider.set(self.brush_opacity)
+        self.brush_opacity_slider.grid(row=4, column=2, padx=5, sticky='sw')
 
     def choose_color(self):
         color = colorchooser.askcolor(title="Choose color")
         if color[1]:  # Only update if a color was selected
             self.color_code = color
 
+    def update_brush_size(self, value):
+        self.brush_size = int(value)
+
+    def update_brush_opacity(self, value):
+        self.brush_opacity = float(value)
+
+    # While the mouse moves the stroke is only drawn on the canvas; the full-resolution image
+    # gets one anti-aliased polyline when the button is released.
     def start_draw(self, event):
-        self.x = event.x
-        self.y = event.y
-        self.draw_ids = []
+        # A previewed filter renders at full resolution while the stroke is drawn
+        self.resolve_filtered_image(lambda: None)
+        self.stroke = Stroke(self.canvas, self.color_code[1], self.brush_size, self.brush_opacity)
+        self.stroke.add(event.x, event.y)
 
     def draw(self, event):
-        self.draw_ids.append(self.canvas.create_line(self.x, self.y, event.x, event.y, width=2,
-                                                    fill=self.color_code[1], capstyle=ROUND, smooth=True))
-        cv2.line(self.filtered_image, (int(self.x * self.ratio), int(self.y * self.ratio)),
-                 (int(event.x * self.ratio), int(event.y * self.ratio)),
-                 tuple(map(int, self.color_code[0])), thickness=int(self.ratio * 2), lineType=cv2.LINE_AA)
-        self.x = event.x
-        self.y = event.y
+        if self.stroke is not None and self.stroke.points[-1] != (event.x, event.y):
+            self.stroke.add(event.x, event.y)
+
+    def end_draw(self, event):
+        if self.stroke is None:
+            return
+        stroke, self.stroke = self.stroke, None
+        r, g, b = tuple(map(int, self.color_code[0]))
+        step = pipeline.make_step('stroke', {
+            'points': [list(self.viewport.to_image(x, y)) for x, y in stroke.points], 'color': [b, g, r],
+            'size': max(1, int(stroke.width / self.viewport.zoom)), 'opacity': self.brush_opacity})
+        self.resolve_filtered_image(partial(self.add_stroke, stroke, step))
+
+    def add_stroke(self, stroke, step):
+        image = self.filtered_image
+        # Results shared with the edited image are copied too
+        self.filtered_image = pipeline.drawable(image, self.edited_image)
+        pipeline.draw_stroke(self.filtered_image, step['value'])
+        self.pyramids.update(image, self.filtered_image, pipeline.stroke_bounds(step['value'], image.shape))
+        self.filtered_steps.append(step)
+        self.display_image(self.filtered_image)
+        stroke.clear()
 
     # Filter Menu
     def refresh_side_frame(self):
@@ -229,9 +434,10 @@ class FrontEnd:
             self.side_frame.grid_forget()
         except:
             pass
-        self.canvas.unbind("<ButtonPress>")
+        self.canvas.unbind("<ButtonPress-1>")
         self.canvas.unbind("<B1-Motion>")
-        self.canvas.unbind("<ButtonRelease>")
+        self.canvas.unbind("<ButtonRelease-1>")
+        self.renderer.cancel('preview')
         if self.edited_image is not None:
             self.display_image(self.edited_image)
         self.side_frame = ttk.Frame(self.frame_menu)
@@ -243,19 +449,10 @@ class FrontEnd:
             messagebox.showerror("Error", "Please upload an image first!")
             return
         self.refresh_side_frame()
-        filters = [
-            ("Negative", self.negative_action),
-            ("Black And White", self.bw_action),
-            ("Stylisation", self.stylisation_action),
-            ("Sketch Effect", self.sketch_action),
-            ("Emboss", self.emb_action),
-            ("Sepia", self.sepia_action),
-            ("Binary Thresholding", self.binary_threshold_action),
-            ("Erosion", self.erosion_action),
-            ("Dilation", self.dilation_action)
-        ]
-        for i, (text, command) in enumerate(filters):
-            ttk.Button(self.side_frame, text=text, command=command).grid(row=i, column=2, padx=5, pady=5, sticky='sw')
+        # Built-in filters and those added by plugins (see filters.py)
+        for i, (text, name) in enumerate(filters.load()):
+            ttk.Button(self.side_frame, text=text, command=partial(self.preview_action, name)).grid(
+                row=i, column=2, padx=5, pady=5, sticky='sw')
 
     # Blur Menu
     def blur_action(self):
@@ -281,6 +478,9 @@ class FrontEnd:
         self.refresh_side_frame()
         ttk.Button(self.side_frame, text="Rotate Left", command=self.rotate_left_action).grid(row=0, column=2, padx=5, pady=5, sticky='sw')
         ttk.Button(self.side_frame, text="Rotate Right", command=self.rotate_right_action).grid(row=1, column=2, padx=5, pady=5, sticky='sw')
+        ttk.Label(self.side_frame, text="Angle").grid(row=2, column=2, padx=5, sticky='sw')
+        self.angle_slider = Scale(self.side_frame, from_=-180, to=180, orient=HORIZONTAL, command=self.angle_action)
+        self.angle_slider.grid(row=3, column=2, padx=5, sticky='sw')
 
     def flip_action(self):
         if self.original_image is None:
@@ -296,14 +496,25 @@ class FrontEnd:
             messagebox.showerror("Error", "Please upload an image first!")
             return
         self.refresh_side_frame()
-        ttk.Label(self.side_frame, text="Brightness").grid(row=0, column=2, padx=5, pady=5, sticky='sw')
-        self.brightness_slider = Scale(self.side_frame, from_=0, to_=2, resolution=0.1, orient=HORIZONTAL, command=self.brightness_action)
-        self.brightness_slider.grid(row=1, column=2, padx=5, sticky='sw')
-        self.brightness_slider.set(1)
-        ttk.Label(self.side_frame, text="Saturation").grid(row=2, column=2, padx=5, pady=5, sticky='sw')
-        self.saturation_slider = Scale(self.side_frame, from_=-200, to=200, resolution=0.5, orient=HORIZONTAL, command=self.saturation_action)
-        self.saturation_slider.grid(row=3, column=2, padx=5, sticky='sw')
-        self.saturation_slider.set(0)
+        # All sliders feed one "adjust" step, rendered as a single lookup table pass
+        self.adjust_values = dict(pipeline.ADJUST_DEFAULTS)
+        self.adjust_sliders = {}
+        sliders = [
+            ("Brightness", 'brightness', 0, 2, 0.1),
+            ("Offset", 'offset', -200, 200, 0.5),
+            ("Contrast", 'contrast', 0, 2, 0.1),
+            ("Gamma", 'gamma', 0.1, 3, 0.1),
+            ("Shadows", 'shadows', -64, 64, 1),
+            ("Highlights", 'highlights', -64, 64, 1),
+            ("Saturation", 'saturation', 0, 2, 0.1)
+        ]
+        for i, (text, key, from_, to, resolution) in enumerate(sliders):
+            ttk.Label(self.side_frame, text=text).grid(row=2 * i, column=2, padx=5, sticky='sw')
+            slider = Scale(self.side_frame, from_=from_, to=to, resolution=resolution, orient=HORIZONTAL,
+                           command=partial(self.adjust_value_action, key))
+            slider.grid(row=2 * i + 1, column=2, padx=5, sticky='sw')
+            slider.set(self.adjust_values[key])
+            self.adjust_sliders[key] = slider
 
     def save_action(self):
         if self.original_image is None:
@@ -312,154 +523,462 @@ class FrontEnd:
         original_file_type = self.filename.split('.')[-1]
         filename = filedialog.asksaveasfilename(defaultextension=f".{original_file_type}", filetypes=[("Image files", f"*.{original_file_type}")])
         if filename:
-            cv2.imwrite(filename, self.edited_image)
-            self.filename = filename
-            self.status_label.config(text=f"Saved as: {filename.split('/')[-1]}")
-            messagebox.showinfo("Success", "Image saved successfully!")
+            if self.start_export([export.make_target(filename)]):
+                self.filename = filename
         else:
-            self.status_label.config(text="Save cancelled")
-
-    # Filter Actions
-    def negative_action(self):
-        self.filtered_image = cv2.bitwise_not(self.edited_image)
-        self.display_image(self.filtered_image)
-
-    def bw_action(self):
-        self.filtered_image = cv2.cvtColor(self.edited_image, cv2.COLOR_BGR2GRAY)
-        self.filtered_image = cv2.cvtColor(self.filtered_image, cv2.COLOR_GRAY2BGR)
-        self.display_image(self.filtered_image)
-
-    def stylisation_action(self):
-        self.filtered_image = cv2.stylization(self.edited_image, sigma_s=150, sigma_r=0.25)
-        self.display_image(self.filtered_image)
-
-    def sketch_action(self):
-        ret, self.filtered_image = cv2.pencilSketch(self.edited_image, sigma_s=60, sigma_r=0.5, shade_factor=0.02)
-        self.display_image(self.filtered_image)
-
-    def emb_action(self):
-        kernel = np.array([[0, -1, -1], [1, 0, -1], [1, 1, 0]])
-        self.filtered_image = cv2.filter2D(self.original_image, -1, kernel)
-        self.display_image(self.filtered_image)
+            self.set_status("Save cancelled")
 
-    def sepia_action(self):
-        kernel = np.array([[0.272, 0.534, 0.131], [0.349, 0.686, 0.168], [0.393, 0.769, 0.189]])
-        self.filtered_image = cv2.filter2D(self.original_image, -1, kernel)
-        self.display_image(self.filtered_image)
-
-    def binary_threshold_action(self):
-        ret, self.filtered_image = cv2.threshold(self.edited_image, 127, 255, cv2.THRESH_BINARY)
-        self.display_image(self.filtered_image)
+    # Export Menu
+    def export_action(self):
+        if self.original_image is None:
+            messagebox.showerror("Error", "Please upload an image first!")
+            return
+        self.refresh_side_frame()
+        ttk.Label(self.side_frame, text="JPEG Quality").grid(row=0, column=2, padx=5, sticky='sw')
+        self.export_quality_slider = Scale(self.side_frame, from_=1, to=100, orient=HORIZONTAL, command=self.update_export_quality)
+        self.export_quality_slider.set(self.export_quality)
+        self.export_quality_slider.grid(row=1, column=2, padx=5, sticky='sw')
+        ttk.Label(self.side_frame, text="PNG Compression").grid(row=2, column=2, padx=5, sticky='sw')
+        self.export_compression_slider = Scale(self.side_frame, from_=0, to=9, orient=HORIZONTAL, command=self.update_export_compression)
+        self.export_compression_slider.set(self.export_compression)
+        self.export_compression_slider.grid(row=3, column=2, padx=5, sticky='sw')
+        ttk.Label(self.side_frame, text="Web Sizes (px)").grid(row=4, column=2, padx=5, pady=5, sticky='sw')
+        self.export_sizes_entry = ttk.Entry(self.side_frame)
+        self.export_sizes_entry.insert(0, self.export_sizes)
+        self.export_sizes_entry.grid(row=5, column=2, padx=5, sticky='sw')
+        ttk.Button(self.side_frame, text="Export To Folder", command=self.export_folder_action).grid(row=6, column=2, padx=5, pady=5, sticky='sw')
+
+    def update_export_quality(self, value):
+        self.export_quality = int(value)
+
+    def update_export_compression(self, value):
+        self.export_compression = int(value)
+
+    def export_folder_action(self):
+        self.export_sizes = self.export_sizes_entry.get()
+        try:
+            sizes = [int(size) for size in self.export_sizes.replace(' ', '').split(',') if size]
+        except ValueError:
+            messagebox.showerror("Error", "Web sizes must be whole numbers separated by commas.")
+            return
+        directory = filedialog.askdirectory(title="Export to folder")
+        if not directory:
+            self.set_status("Export cancelled")
+            return
+        stem = os.path.splitext(os.path.basename(self.filename))[0]
+        self.start_export(export.deliverable_targets(directory, stem, self.export_quality, self.export_compression, sizes))
+
+    def start_export(self, targets):
+        if self.export_job is not None:
+            messagebox.showerror("Error", "An export is already running.")
+            return False
+        # Edits never modify edited_image in place, so it can be encoded while editing goes on
+        self.export_job = export.ExportJob(self.master, self.edited_image, targets, self.export_progress,
+                                           self.export_done, self.export_failed)
+        self.progress_bar.config(value=0)
+        self.progress_bar.pack(fill='x', padx=10, pady=5)
+        self.set_status(f"Exporting {len(targets)} file{'s' if len(targets) > 1 else ''}...")
+        return True
+
+    def export_progress(self, progress):
+        done, total = progress
+        self.progress_bar.config(value=done / total)
+        self.set_status(f"Exporting: {done} of {total} files written")
+
+    def export_done(self, results):
+        self.export_job = None
+        self.progress_bar.pack_forget()
+        if len(results) == 1:
+            self.set_status(f"Saved as: {results[0]['path'].split('/')[-1]}")
+            messagebox.showinfo("Success", "Image saved successfully!\n" + export.describe(results[0]))
+        else:
+            self.set_status(f"Exported {len(results)} files")
+            messagebox.showinfo("Export Finished", '\n'.join(export.describe(result) for result in results))
+
+    def export_failed(self, error):
+        self.export_job = None
+        self.progress_bar.pack_forget()
+        messagebox.showerror("Error", f"Export failed: {error}")
+        self.set_status("Export failed")
+
+    # Frames Menu: scrubbing shows display-size frames with the applied changes
+    def frames_action(self):
+        if self.clip is None:
+            messagebox.showerror("Error", "Please upload an animated GIF or a video first!")
+            return
+        self.refresh_side_frame()
+        ttk.Label(self.side_frame, text="Frame").grid(row=0, column=2, padx=5, sticky='sw')
+        self.frame_slider = Scale(self.side_frame, from_=0, to=self.clip.count - 1, orient=HORIZONTAL, command=self.scrub_action)
+        self.frame_slider.grid(row=1, column=2, padx=5, sticky='sw')
+        ttk.Button(self.side_frame, text="Export Clip", command=self.export_clip_action).grid(row=2, column=2, padx=5, pady=5, sticky='sw')
+
+    def scrub_action(self, value):
+        found = self.clip.get(int(value))
+        if found is None:
+            self.set_status("Frames are still being decoded")
+            return
+        index, proxy = found
+        self.renderer.submit('preview', partial(self.show_frame, index), pipeline.run, proxy, self.history.steps(),
+                             scale=self.clip.scale, error_callback=self.render_failed)
 
-    def erosion_action(self):
-        kernel = np.ones((5, 5), np.uint8)
-        self.filtered_image = cv2.erode(self.edited_image, kernel, iterations=1)
-        self.display_image(self.filtered_image)
+    def show_frame(self, index, image):
+        self.display_image(image, scale=self.clip.scale)
+        self.set_status(f"Frame {index + 1} of {self.clip.count} with the applied changes")
 
-    def dilation_action(self):
-        kernel = np.ones((5, 5), np.uint8)
-        self.filtered_image = cv2.dilate(self.edited_image, kernel, iterations=1)
-        self.display_image(self.filtered_image)
+    def export_clip_action(self):
+        if self.export_job is not None:
+            messagebox.showerror("Error", "An export is already running.")
+            return
+        clip_types = ' '.join('*' + extension for extension in frames.CLIP_EXTENSIONS)
+        filename = filedialog.asksaveasfilename(defaultextension=os.path.splitext(self.clip.path)[1],
+                                                filetypes=[("Animations and video", clip_types)])
+        if not filename:
+            self.set_status("Export cancelled")
+            return
+        self.export_job = frames.ClipJob(self.master, self.clip.path, filename, self.history.steps(), self.clip_progress,
+                                         self.clip_done, self.export_failed)
+        self.progress_bar.config(value=0)
+        self.progress_bar.pack(fill='x', padx=10, pady=5)
+        self.set_status("Exporting clip...")
+
+    def clip_progress(self, progress):
+        done, total, fps = progress
+        self.progress_bar.config(value=done / total)
+        self.set_status(f"Exporting clip: frame {done} of {total} ({fps:.1f} fps)")
+
+    def clip_done(self, result):
+        self.export_job = None
+        self.progress_bar.pack_forget()
+        self.set_status(f"Saved clip: {result['path'].split('/')[-1]} ({result['fps']:.1f} fps)")
+        messagebox.showinfo("Success", "Clip saved successfully!\n" + frames.describe(result))
 
     # Blur Actions
     def averaging_action(self, value):
-        value = int(value)
-        if value % 2 == 0:
-            value += 1
-        self.filtered_image = cv2.blur(self.edited_image, (value, value))
-        self.display_image(self.filtered_image)
+        self.preview_action('average_blur', int(value))
 
     def gaussian_action(self, value):
-        value = int(value)
-        if value % 2 == 0:
-            value += 1
-        self.filtered_image = cv2.GaussianBlur(self.edited_image, (value, value), 0)
-        self.display_image(self.filtered_image)
+        self.preview_action('gaussian_blur', int(value))
 
     def median_action(self, value):
-        value = int(value)
-        if value % 2 == 0:
-            value += 1
-        self.filtered_image = cv2.medianBlur(self.edited_image, value)
-        self.display_image(self.filtered_image)
+        self.preview_action('median_blur', int(value))
 
     # Adjust Actions
-    def brightness_action(self, value):
-        self.filtered_image = cv2.convertScaleAbs(self.edited_image, alpha=float(value))
+    def adjust_value_action(self, key, value):
+        self.adjust_values[key] = float(value)
+        self.preview_action('adjust', dict(self.adjust_values))
+
+    # Preview Pipeline
+    def reset_preview(self):
+        self.preview_image = None
+        self.preview_scale = 1
+        self.pending_filter = None
+        self.resolving = None
+        self.filtered_steps = []
+
+    def get_preview_image(self):
+        if self.preview_image is None:
+            height, width = self.edited_image.shape[:2]
+            new_width, new_height = pipeline.fit_size(width, height)
+            if (new_width, new_height) == (width, height):
+                self.preview_image = self.edited_image
+            else:
+                self.preview_image = cv2.resize(self.edited_image, (new_width, new_height), interpolation=cv2.INTER_AREA)
+            self.preview_scale = height / new_height
+        return self.preview_image
+
+    def preview_action(self, name, value=None):
+        if self.resolving is not None:
+            # Edits wait for the filter being rendered, in the order they were made
+            self.resolving.append(partial(self.preview_action, name, value))
+            return
+        step = pipeline.make_step(name, value)
+        self.pending_filter = step
+        self.filtered_steps = [step]
+        source = self.get_preview_image()
+        self.renderer.submit('preview', partial(self.show_preview, source, step), pipeline.apply_step, source, step,
+                             scale=self.preview_scale, cache=self.result_cache, error_callback=self.render_failed)
+
+    def show_preview(self, source, step, preview):
+        if source is not self.preview_image:
+            return
+        if self.preview_image is self.edited_image:
+            # Image already fits the canvas, so the preview is the full-resolution result
+            self.pending_filter = None
+            self.filtered_image = preview
+        # Shown at the size of the full-resolution result, which a rotation changes
+        height, width = self.edited_image.shape[:2]
+        self.display_image(preview, scale=self.preview_scale, size=pipeline.output_size([step], width, height))
+
+    def render_failed(self, error):
+        messagebox.showerror("Error", f"Failed to render image: {error}")
+
+    def resolve_filtered_image(self, then):
+        # Calls `then` once filtered_image is at full resolution. A previewed filter is
+        # rendered on the worker first, and what else comes meanwhile waits for it.
+        self.renderer.cancel('preview')
+        if self.pending_filter is not None:
+            step, self.pending_filter = self.pending_filter, None
+            self.resolving = [then]
+            self.renderer.submit('apply', self.filter_resolved, pipeline.apply_step,
+                                 self.edited_image, step, cache=self.result_cache, error_callback=self.resolve_failed)
+        elif self.resolving is not None:
+            # An edit made meanwhile may preview another filter first
+            self.resolving.append(partial(self.resolve_filtered_image, then))
+        else:
+            then()
+
+    def filter_resolved(self, image):
+        callbacks, self.resolving = self.resolving, None
+        self.filtered_image = image
+        for i, then in enumerate(callbacks):
+            if self.resolving is not None:
+                # A callback started rendering another filter; the rest wait for that one
+                self.resolving.extend(callbacks[i:])
+                break
+            then()
+
+    def resolve_failed(self, error):
+        self.resolving = None
+        self.render_failed(error)
+
+    # Steps computed directly at full resolution
+    def set_filtered_step(self, step):
+        if self.resolving is not None:
+            self.resolving.append(partial(self.set_filtered_step, step))
+            return
+        self.renderer.cancel('preview')
+        self.pending_filter = None
+        self.filtered_steps = [step]
+        self.filtered_image = pipeline.apply_step(self.edited_image, step, cache=self.result_cache)
         self.display_image(self.filtered_image)
 
-    def saturation_action(self, value):
-        self.filtered_image = cv2.convertScaleAbs(self.edited_image, beta=float(value))
+    def add_filtered_step(self, step):
+        self.resolve_filtered_image(partial(self.apply_filtered_step, step))
+
+    def apply_filtered_step(self, step):
+        self.filtered_steps.append(step)
+        self.filtered_image = pipeline.apply_step(self.filtered_image, step, cache=self.result_cache)
         self.display_image(self.filtered_image)
 
     # Rotate and Flip Actions
     def rotate_left_action(self):
-        self.filtered_image = cv2.rotate(self.filtered_image, cv2.ROTATE_90_COUNTERCLOCKWISE)
-        self.display_image(self.filtered_image)
+        self.add_filtered_step(pipeline.make_step('rotate_left'))
 
     def rotate_right_action(self):
-        self.filtered_image = cv2.rotate(self.filtered_image, cv2.ROTATE_90_CLOCKWISE)
-        self.display_image(self.filtered_image)
+        self.add_filtered_step(pipeline.make_step('rotate_right'))
 
     def vertical_action(self):
-        self.filtered_image = cv2.flip(self.filtered_image, 0)
-        self.display_image(self.filtered_image)
+        self.add_filtered_step(pipeline.make_step('flip_vertical'))
 
     def horizontal_action(self):
-        self.filtered_image = cv2.flip(self.filtered_image, 1)
-        self.display_image(self.filtered_image)
+        self.add_filtered_step(pipeline.make_step('flip_horizontal'))
+
+    def angle_action(self, value):
+        self.preview_action('rotate', int(value))
 
     # Footer Actions
     def apply_action(self):
         if self.original_image is None:
             messagebox.showerror("Error", "Please upload an image first!")
             return
-        self.edited_image = self.filtered_image.copy()
+        if self.renderer.busy('history'):
+            return
+        self.resolve_filtered_image(self.commit_filtered)
+
+    def commit_filtered(self):
+        steps, self.filtered_steps = self.filtered_steps, []
+        self.commit_image(steps, self.filtered_image)
+
+    def commit_image(self, steps, image):
+        self.history.push(steps, image)
+        self.edited_image = image
+        self.filtered_image = image
+        self.reset_preview()
         self.display_image(self.edited_image)
-        self.status_label.config(text="Changes applied")
+        self.set_status(f"Changes applied ({self.history_usage()})")
 
     def cancel_action(self):
         if self.original_image is None:
             messagebox.showerror("Error", "Please upload an image first!")
             return
+        self.renderer.cancel('preview')
         self.display_image(self.edited_image)
-        self.status_label.config(text="Changes cancelled")
+        self.set_status("Changes cancelled")
 
     def revert_action(self):
         if self.original_image is None:
             messagebox.showerror("Error", "Please upload an image first!")
             return
-        self.edited_image = self.original_image.copy()
-        self.filtered_image = self.original_image.copy()
+        self.renderer.cancel('preview')
+        self.renderer.cancel('apply')
+        self.renderer.cancel('history')
+        self.history.move(0)
+        self.edited_image = self.original_image
+        self.filtered_image = self.original_image
+        self.reset_preview()
         self.display_image(self.original_image)
-        self.status_label.config(text="All changes reverted")
+        self.set_status("All changes reverted (Redo restores them)")
+
+    def undo_action(self):
+        if self.history is None or not self.history.can_undo():
+            self.set_status("Nothing to undo")
+            return
+        self.move_history(self.history.position - 1, "Undo")
+
+    def redo_action(self):
+        if self.history is None or not self.history.can_redo():
+            self.set_status("Nothing to redo")
+            return
+        self.move_history(self.history.position + 1, "Redo")
+
+    def move_history(self, position, label):
+        self.renderer.cancel('preview')
+        self.renderer.cancel('apply')
+        self.resolving = None
+        position = self.history.move(position)
+        self.renderer.submit('history', partial(self.show_history, position, label), self.history.render, position,
+                             error_callback=self.render_failed)
+
+    def show_history(self, position, label, image):
+        self.edited_image = image
+        self.filtered_image = image
+        self.reset_preview()
+        self.display_image(self.edited_image)
+        self.set_status(f"{label}: {position}/{len(self.history.commands)} changes applied in "
+                        f"{self.history.last_latency * 1000:.0f} ms ({self.history_usage()})")
+
+    def history_usage(self):
+        text = f"history {self.history_store.memory_bytes / 1e6:.1f} MB"
+        if self.history_store.disk_bytes:
+            text += f" + {self.history_store.disk_bytes / 1e6:.1f} MB on disk"
+        return text
+
+    def save_recipe_action(self):
+        if self.original_image is None:
+            messagebox.showerror("Error", "Please upload an image first!")
+            return
+        filename = filedialog.asksaveasfilename(defaultextension=".json", filetypes=[("Edit recipes", "*.json")])
+        if filename:
+            steps = self.history.steps()
+            pipeline.save_recipe(filename, steps)
+            self.set_status(f"Recipe saved as: {filename.split('/')[-1]} ({len(steps)} steps)")
+
+    # Tracing
+    def instrument(self):
+        for name in dir(self):
+            if name.endswith('_action') or name in TRACED_HANDLERS:
+                setattr(self, name, self.traced_handler(name, getattr(self, name)))
+
+    def traced_handler(self, name, method):
+        method = tracing.traced(f"FrontEnd.{name}", method)
+
+        def handler(*args, **kwargs):
+            result = method(*args, **kwargs)
+            self.update_status()
+            return result
+        return handler
+
+    def export_trace_action(self):
+        if not tracing.TRACER.enabled:
+            messagebox.showinfo("Tracing", "Tracing is off. Start the editor with EDITOR_TRACE=1 to record a trace.")
+            return
+        filename = filedialog.asksaveasfilename(defaultextension=".json", filetypes=[("Chrome trace", "*.json")])
+        if filename:
+            tracing.TRACER.export(filename)
+            self.set_status(f"Trace saved as: {filename.split('/')[-1]}")
+            messagebox.showinfo("Operation Timings", tracing.TRACER.summary() or "Nothing recorded yet")
+
+    def cache_stats_action(self):
+        self.finish_startup()
+        stats = self.result_cache.stats()
+        messagebox.showinfo("Result Cache", f"Hits: {stats['hits']}\nMisses: {stats['misses']}\n"
+                                            f"Hit rate: {stats['hit_rate']:.0%}\nEvictions: {stats['evictions']}\n"
+                                            f"Entries: {stats['entries']} using {stats['bytes'] / 2 ** 20:.1f} of "
+                                            f"{stats['budget_bytes'] / 2 ** 20:.0f} MB")
+
+    # Status Bar
+    def set_status(self, text):
+        self.status_text = text
+        self.update_status()
+
+    def set_rendering(self, rendering):
+        self.rendering = rendering
+        self.update_status()
+
+    def update_status(self):
+        text = self.status_text
+        if self.rendering:
+            text += " - rendering..."
+        if self.shown is not None and self.viewport.zoom != self.viewport.fit_zoom:
+            text += f" | zoom {self.viewport.zoom * 100:.0f}%"
+        if tracing.TRACER.enabled:
+            text += ''.join(f" | {name} {seconds * 1000:.1f} ms" for name, seconds in tracing.TRACER.latest(('FrontEnd', 'op')))
+        self.status_label.config(text=text)
+
+    # Viewport
+    def zoom_action(self, event):
+        if self.shown is None:
+            return
+        zoom_in = event.num == 4 or event.delta > 0
+        self.viewport.zoom_at(1.25 if zoom_in else 0.8, event.x, event.y)
+        self.show_viewport()
+
+    def fit_view_action(self):
+        if self.shown is None:
+            return
+        self.viewport.reset()
+        self.show_viewport()
 
-    def display_image(self, image=None):
+    def start_pan(self, event):
+        self.pan_x = event.x
+        self.pan_y = event.y
+
+    def pan_view(self, event):
+        if self.shown is None:
+            return
+        self.viewport.pan(event.x - self.pan_x, event.y - self.pan_y)
+        self.pan_x = event.x
+        self.pan_y = event.y
+        self.show_viewport()
+
+    def display_image(self, image=None, scale=1, size=None):
         self.canvas.delete("all")
         if image is None:
             if self.edited_image is not None:
-                image = self.edited_image.copy()
+                image = self.edited_image
             else:
                 return
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        height, width, channels = image.shape
-        ratio = height / width
-        new_width = width
-        new_height = height
-        if height > 400 or width > 300:
-            if ratio < 1:
-                new_width = 300
-                new_height = int(new_width * ratio)
-            else:
-                new_height = 400
-                new_width = int(new_height / ratio)
-        self.ratio = height / new_height
-        self.new_image = cv2.resize(image, (new_width, new_height))
-        self.new_image = ImageTk.PhotoImage(Image.fromarray(self.new_image))
-        self.canvas.config(width=new_width, height=new_height)
-        self.canvas.create_image(new_width / 2, new_height / 2, image=self.new_image)
+        if size is not None:
+            width, height = size
+        else:
+            # Previews are proxies of the edited image and are shown in its coordinates
+            height, width = (image if scale == 1 else self.edited_image).shape[:2]
+        if not width or not height:
+            return
+        if self.viewport.fit(width, height):
+            self.canvas.config(width=self.viewport.width, height=self.viewport.height)
+        self.shown = self.pyramids.get(image, scale)
+        self.show_viewport()
+
+    def show_viewport(self):
+        frame, (left, top) = self.viewport.render(self.shown)
+        with tracing.span('display.photoimage'):
+            self.new_image = ImageTk.PhotoImage(Image.fromarray(frame))
+        with tracing.span('display.canvas'):
+            self.canvas.delete("view")
+            self.canvas.create_image(int(round(left)), int(round(top)), anchor=NW, image=self.new_image, tags="view")
+            # Keep crop rectangles and strokes above the image
+            self.canvas.tag_lower("view")
+        self.update_status()
+        if tracing.TRACER.enabled:
+            # Time until Tk gets back to idle, which includes redrawing the canvas
+            start = time.perf_counter()
+            self.master.after_idle(lambda: tracing.TRACER.record('tk.redraw', start, time.perf_counter()))
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        command = importlib.import_module(COMMANDS[sys.argv[1]])
+        sys.exit(command.main(sys.argv[2:]))
     root = Tk()
     app = FrontEnd(root)
     root.mainloop()
\ No newline at end of file
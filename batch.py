@@ -0,0 +1,80 @@
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import filters
+import pipeline
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif')
+
+
+def list_images(directory):
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                yield entry.path
+
+
+def output_path(source, output_dir, extension=None):
+    name, original_extension = os.path.splitext(os.path.basename(source))
+    if extension is None:
+        extension = original_extension
+    return os.path.join(output_dir, name + '.' + extension.lstrip('.'))
+
+
+def init_worker():
+    # Workers already run in parallel, so keep OpenCV and banded filters from oversubscribing the cores
+    pipeline.cv2.setNumThreads(1)
+    pipeline.parallel.WORKERS = 1
+    # Spawned processes start without the operations added by filter plugins
+    filters.load()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='app.py batch', description='Apply a saved edit recipe to every image in a directory.')
+    parser.add_argument('recipe', help='recipe file saved from the editor')
+    parser.add_argument('input_dir')
+    parser.add_argument('output_dir')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--max-in-flight', type=int, help='maximum files queued or processing at once (default: 2 x workers)')
+    parser.add_argument('--format', help='output file extension, e.g. png (default: same as input)')
+    args = parser.parse_args(argv)
+
+    steps = pipeline.load_recipe(args.recipe)
+    os.makedirs(args.output_dir, exist_ok=True)
+    max_in_flight = args.max_in_flight or 2 * args.workers
+    processed = failed = 0
+    total_megapixels = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker) as executor:
+        in_flight = {}
+        files = list_images(args.input_dir)
+        while True:
+            # Only pull more files from the directory once there is room, so memory stays bounded
+            while len(in_flight) < max_in_flight:
+                source = next(files, None)
+                if source is None:
+                    break
+                future = executor.submit(pipeline.process_file, source, output_path(source, args.output_dir, args.format), steps)
+                in_flight[future] = source
+            if not in_flight:
+                break
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                source = in_flight.pop(future)
+                name = os.path.basename(source)
+                try:
+                    megapixels, seconds = future.result()
+                except Exception as e:
+                    failed += 1
+                    print(f"{name}: failed: {e}", file=sys.stderr)
+                    continue
+                processed += 1
+                total_megapixels += megapixels
+                print(f"{name}: {megapixels:.1f} MP in {seconds:.2f} s ({megapixels / seconds:.1f} MP/s)")
+    elapsed = time.perf_counter() - start
+    print(f"Processed {processed} files ({total_megapixels:.1f} MP) in {elapsed:.2f} s: "
+          f"{processed / elapsed:.2f} files/s, {total_megapixels / elapsed:.1f} MP/s, {failed} failed")
+    return 1 if failed else 0
@@ -0,0 +1,173 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import sys
+import time
+
+import cv2
+import numpy as np
+
+import parallel
+import pipeline
+import tiles
+from viewport import Pyramid, Viewport
+
+DEFAULT_SIZES = '1,4,16,50,100'
+
+
+def sample_step(name, width, height):
+    if name == 'crop':
+        return pipeline.make_step(name, [width // 4, height // 4, 3 * width // 4, 3 * height // 4])
+    if name == 'text':
+        return pipeline.make_step(name, {'text': 'Benchmark', 'position': [width // 10, height // 2],
+                                         'color': [0, 0, 255], 'font_size': max(1, width // 500)})
+    if name == 'draw':
+        # A long zigzag stroke, as drawn with the mouse
+        xs = np.linspace(0, width - 1, 201).astype(int)
+        ys = np.where(np.arange(201) % 2, height // 4, 3 * height // 4)
+        lines = [[int(xs[i]), int(ys[i]), int(xs[i + 1]), int(ys[i + 1])] for i in range(200)]
+        return pipeline.make_step(name, {'color': [255, 0, 0], 'thickness': max(2, width // 300), 'lines': lines})
+    if name == 'stroke':
+        xs = np.linspace(0, width - 1, 201).astype(int)
+        ys = np.where(np.arange(201) % 2, height // 4, 3 * height // 4)
+        return pipeline.make_step(name, {'points': [[int(x), int(y)] for x, y in zip(xs, ys)], 'color': [255, 0, 0],
+                                         'size': max(2, width // 300), 'opacity': 0.5})
+    return pipeline.make_step(name, pipeline.SAMPLE_VALUES.get(name))
+
+
+def benchmarks(width, height):
+    # (name, function) pairs covering every editor operation plus the canvas refresh
+    for name in pipeline.OPERATIONS:
+        step = sample_step(name, width, height)
+        yield name, lambda image, step=step: pipeline.apply_step(image, step)
+    yield 'display', first_paint
+
+
+def first_paint(image):
+    # Fitting a freshly loaded image to the canvas, including building its pyramid level
+    viewport = Viewport(pipeline.DISPLAY_WIDTH, pipeline.DISPLAY_HEIGHT)
+    viewport.fit(image.shape[1], image.shape[0])
+    return viewport.render(Pyramid(image))
+
+
+def reset_peak_rss():
+    # Linux lets a process reset its peak RSS; elsewhere the peak only ever grows
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def measure(function, image, repeat):
+    function(image)
+    times = []
+    reset_peak_rss()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(image)
+        times.append(time.perf_counter() - start)
+    return times, peak_rss_mb()
+
+
+def run(sizes, names=None, repeat=3, tiled=False, log=print):
+    results = []
+    for megapixels in sizes:
+        image = pipeline.synthetic_image(megapixels)
+        if tiled:
+            image = tiles.materialize(image)
+        height, width = image.shape[:2]
+        actual_megapixels = width * height / 1e6
+        for name, function in benchmarks(width, height):
+            if names and name not in names:
+                continue
+            times, peak = measure(function, image, repeat)
+            seconds = statistics.median(times)
+            result = {
+                'op': name,
+                'megapixels': megapixels,
+                'width': width,
+                'height': height,
+                'seconds': seconds,
+                'min_seconds': min(times),
+                'mp_per_s': actual_megapixels / seconds if seconds else float('inf'),
+                'peak_rss_mb': peak,
+            }
+            results.append(result)
+            log(f"{name:>16} {megapixels:>6g} MP  {seconds * 1000:10.1f} ms  {result['mp_per_s']:9.1f} MP/s  "
+                f"peak RSS {peak:8.0f} MB")
+        del image
+    return results
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'opencv': cv2.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'workers': parallel.WORKERS,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def compare(results, baseline, threshold):
+    # Returns the results that got slower than the baseline by more than `threshold`
+    previous = {(result['op'], result['megapixels']): result for result in baseline['results']}
+    regressions = []
+    for result in results:
+        old = previous.get((result['op'], result['megapixels']))
+        if old is None or not old['seconds']:
+            continue
+        change = result['seconds'] / old['seconds'] - 1
+        if change > threshold:
+            regressions.append((result, old, change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='app.py bench', description='Benchmark every editor operation on synthetic images.')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help=f'comma-separated image sizes in megapixels (default: {DEFAULT_SIZES})')
+    parser.add_argument('--ops', help='comma-separated operations to run (default: all)')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per operation; the median is reported')
+    parser.add_argument('--tiled', action='store_true', help='run on memory-mapped tiled images')
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--compare', help='baseline JSON file from an earlier run')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed slowdown against the baseline (default: 0.2 = 20%%)')
+    args = parser.parse_args(argv)
+
+    sizes = [float(size) for size in args.sizes.split(',')]
+    names = set(args.ops.split(',')) if args.ops else None
+    results = run(sizes, names, args.repeat, args.tiled)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'environment': environment(), 'tiled': args.tiled, 'results': results}, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for result, old, change in regressions:
+            print(f"Regression: {result['op']} at {result['megapixels']:g} MP took {result['seconds'] * 1000:.1f} ms "
+                  f"against {old['seconds'] * 1000:.1f} ms (+{change:.0%})")
+        if regressions:
+            return 1
+        print(f"No regressions above {args.threshold:.0%}")
+    return 0
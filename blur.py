@@ -0,0 +1,120 @@
+import argparse
+import math
+import os
+import time
+
+import cv2
+import numpy as np
+
+# Kernels at least this many pixels wide are blurred on a downscaled copy, so the cost stops
+# growing with the radius. 0 always uses OpenCV's exact filters.
+THRESHOLD = int(os.environ.get('EDITOR_FAST_BLUR', 64))
+# The downscaled kernel keeps at least this many pixels
+MIN_KERNEL = 32
+
+# Difference from OpenCV's exact result that 99% of pixels stay within on the check image.
+# A downscaled Gaussian is within rounding of the exact one. The median is not downscaled:
+# it can move the edges of thin features by up to the reduction factor, and OpenCV's 8-bit
+# median already costs about the same at any kernel size.
+TOLERANCES = {
+    'gaussian': 2,
+}
+
+
+def sigma(ksize):
+    # The sigma OpenCV derives from the kernel size when none is given
+    return 0.3 * ((ksize - 1) * 0.5 - 1) + 0.8
+
+
+def reduction(ksize):
+    if not THRESHOLD or ksize < THRESHOLD:
+        return 1
+    factor = 1
+    while ksize / (factor * 2) >= MIN_KERNEL:
+        factor *= 2
+    return factor
+
+
+def footprint(ksize):
+    # Reach of a blur in pixels, including the downscale block and the interpolation back up
+    return ksize // 2 + 2 * reduction(ksize)
+
+
+def downscaled(function, image, factor, pad):
+    # Runs `function` at 1/factor of the size. The image is first padded by reflection the
+    # way OpenCV treats borders, to a multiple of the factor, so each block averages whole
+    # pixels and the borders match the exact filter.
+    height, width = image.shape[:2]
+    pad = -(-pad // factor) * factor
+    padded = cv2.copyMakeBorder(image, pad, pad + -height % factor, pad, pad + -width % factor, cv2.BORDER_REFLECT_101)
+    padded_height, padded_width = padded.shape[:2]
+    small = cv2.resize(padded, (padded_width // factor, padded_height // factor), interpolation=cv2.INTER_AREA)
+    small = function(small)
+    return cv2.resize(small, (padded_width, padded_height), interpolation=cv2.INTER_LINEAR)[pad:pad + height, pad:pad + width]
+
+
+def box(image, ksize):
+    # Running sums already make the box filter cost the same at any size
+    return cv2.blur(image, (ksize, ksize))
+
+
+def gaussian(image, ksize):
+    factor = reduction(ksize)
+    if factor == 1:
+        return cv2.GaussianBlur(image, (ksize, ksize), 0)
+    # Averaging blocks and interpolating back up blur too; take that variance off the kernel
+    small_sigma = math.sqrt(max(sigma(ksize) ** 2 - factor ** 2 / 4, 0.25)) / factor
+    return downscaled(lambda small: cv2.GaussianBlur(small, (0, 0), small_sigma), image, factor, ksize // 2)
+
+
+def median(image, ksize):
+    return cv2.medianBlur(image, ksize)
+
+
+BLURS = {
+    'box': box,
+    'gaussian': gaussian,
+    'median': median,
+}
+
+EXACT = {
+    'box': lambda image, ksize: cv2.blur(image, (ksize, ksize)),
+    'gaussian': lambda image, ksize: cv2.GaussianBlur(image, (ksize, ksize), 0),
+    'median': cv2.medianBlur,
+}
+
+
+def compare(fast, exact):
+    # (largest, 99th percentile, mean) absolute difference
+    difference = cv2.absdiff(fast, exact)
+    return int(difference.max()), float(np.percentile(difference, 99)), float(difference.mean())
+
+
+def error(kind, image, ksize):
+    return compare(BLURS[kind](image, ksize), EXACT[kind](image, ksize))
+
+
+def main(argv=None):
+    import pipeline
+
+    parser = argparse.ArgumentParser(prog='app.py check-blur',
+                                     description='Compare the large-kernel blurs with the exact OpenCV filters.')
+    parser.add_argument('--megapixels', type=float, default=12)
+    parser.add_argument('--sizes', default='65,129,257', help='comma-separated kernel sizes')
+    args = parser.parse_args(argv)
+
+    image = pipeline.synthetic_image(args.megapixels)
+    failed = False
+    for ksize in [int(size) | 1 for size in args.sizes.split(',')]:
+        for kind in TOLERANCES:
+            start = time.perf_counter()
+            fast = BLURS[kind](image, ksize)
+            fast_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            exact = EXACT[kind](image, ksize)
+            exact_seconds = time.perf_counter() - start
+            largest, p99, mean = compare(fast, exact)
+            failed |= p99 > TOLERANCES[kind]
+            print(f"{kind} {ksize}: 1/{reduction(ksize)} size, {fast_seconds * 1000:.0f} ms against {exact_seconds * 1000:.0f} ms, "
+                  f"error max {largest} p99 {p99:g} mean {mean:.2f} (allowed p99 {TOLERANCES[kind]})")
+    return 1 if failed else 0
@@ -0,0 +1,81 @@
+import json
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+
+
+class ResultCache:
+    # Operation results keyed by (source version, operation, parameters, scale), evicted least
+    # recently used first once their size exceeds budget_bytes. Every distinct source array
+    # gets its own version, which lasts as long as the array; when it is freed its results
+    # are dropped. Cached arrays are made read-only because every caller shares them.
+    def __init__(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+        self.entries = OrderedDict()
+        self.versions = {}
+        self.counter = 0
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Reentrant, since a source being freed drops its entries from whichever thread runs the GC
+        self.lock = threading.RLock()
+
+    def version(self, image):
+        with self.lock:
+            entry = self.versions.get(id(image))
+            if entry is None or entry[0]() is not image:
+                self.counter += 1
+                entry = (weakref.ref(image, lambda ref, version=self.counter: self.forget(version)), self.counter)
+                self.versions[id(image)] = entry
+            return entry[1]
+
+    def key(self, image, name, value=None, scale=1):
+        return self.version(image), name, json.dumps(value, sort_keys=True), scale
+
+    def get_or_compute(self, key, function, source=None):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+        result = function()
+        self.put(key, result, source)
+        return result
+
+    def put(self, key, result, source=None):
+        # A result that is a view of its source is not kept, as freezing it would freeze the source
+        if not self.budget_bytes or result.nbytes > self.budget_bytes or (
+                source is not None and np.may_share_memory(source, result)):
+            return
+        result.flags.writeable = False
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key).nbytes
+            self.entries[key] = result
+            self.nbytes += result.nbytes
+            while self.nbytes > self.budget_bytes:
+                old_key, old = self.entries.popitem(last=False)
+                self.nbytes -= old.nbytes
+                self.evictions += 1
+
+    def forget(self, version):
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == version]:
+                self.nbytes -= self.entries.pop(key).nbytes
+            self.versions = {ident: entry for ident, entry in self.versions.items() if entry[1] != version}
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / lookups if lookups else 0,
+                    'evictions': self.evictions, 'entries': len(self.entries), 'bytes': self.nbytes,
+                    'budget_bytes': self.budget_bytes}
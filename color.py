@@ -0,0 +1,70 @@
+import cv2
+import numpy as np
+
+# Per-channel lookup tables are (256, 3) uint8 arrays, one column per BGR channel
+IDENTITY = np.ascontiguousarray(np.repeat(np.arange(256, dtype=np.uint8)[:, None], 3, axis=1))
+
+# Sepia as a colour matrix in BGR order: each output channel is a weighted sum of B, G and R
+SEPIA = np.array([[0.131, 0.534, 0.272, 0],
+                  [0.168, 0.686, 0.349, 0],
+                  [0.189, 0.769, 0.393, 0]])
+
+
+def lut_from(function):
+    # The table of any per-channel point operation is the operation applied to every value
+    ramp = IDENTITY.reshape(256, 1, 3)
+    return np.ascontiguousarray(function(ramp).reshape(256, 3))
+
+
+def compose(first, second):
+    # Table for applying `first` and then `second`
+    return np.ascontiguousarray(np.take_along_axis(second, first.astype(np.intp), axis=0))
+
+
+def apply_lut(image, lut, out=None):
+    if image.ndim == 2:
+        return cv2.LUT(image, np.ascontiguousarray(lut[:, 0]), dst=out)
+    return cv2.LUT(image, lut.reshape(256, 1, 3), dst=out)
+
+
+def tone_lut(brightness=1, offset=0, contrast=1, gamma=1, shadows=0, highlights=0):
+    # Brightness and offset behave like cv2.convertScaleAbs(alpha, beta); contrast pivots
+    # around mid grey; shadows and highlights lift or lower a curve through the quarter tones.
+    x = np.arange(256, dtype=np.float64)
+    y = np.abs(x * brightness + offset)
+    y = np.clip((y - 127.5) * contrast + 127.5, 0, 255)
+    if gamma != 1:
+        y = 255 * (y / 255) ** (1 / gamma)
+    if shadows or highlights:
+        y = np.interp(y, [0, 64, 192, 255], [0, 64 + shadows, 192 + highlights, 255])
+    lut = np.clip(np.rint(y), 0, 255).astype(np.uint8)
+    return np.ascontiguousarray(np.repeat(lut[:, None], 3, axis=1))
+
+
+def curve_lut(points):
+    # Piecewise-linear curve through (input, output) points, applied to every channel
+    points = sorted(points)
+    lut = np.interp(np.arange(256), [x for x, y in points], [y for x, y in points])
+    lut = np.clip(np.rint(lut), 0, 255).astype(np.uint8)
+    return np.ascontiguousarray(np.repeat(lut[:, None], 3, axis=1))
+
+
+def to_hsv(image):
+    return cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+
+
+def saturate(image, factor, hsv=None):
+    # Scales HSV saturation. The table writes into the HSV buffer, which is then converted back
+    # in place, unless a shared HSV conversion of `image` is passed in.
+    shared = hsv is not None
+    if not shared:
+        hsv = to_hsv(image)
+    lut = IDENTITY.copy()
+    lut[:, 1] = np.clip(np.rint(np.arange(256) * factor), 0, 255).astype(np.uint8)
+    out = apply_lut(hsv, lut, out=None if shared else hsv)
+    return cv2.cvtColor(out, cv2.COLOR_HSV2BGR, dst=out)
+
+
+def apply_matrix(image, matrix):
+    # One pass of a 3x4 colour matrix (3x3 weights plus an offset column)
+    return cv2.transform(image, np.asarray(matrix, dtype=np.float64))
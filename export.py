@@ -0,0 +1,165 @@
+import os
+import queue
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import cv2
+import numpy as np
+
+import tiles
+
+WORKERS = int(os.environ.get('EDITOR_EXPORT_WORKERS', min(4, os.cpu_count() or 1)))
+JPEG_QUALITY = 90
+PNG_COMPRESSION = 3
+
+
+# A target is a dict like a pipeline step: the output path, the encoder setting for its
+# format (JPEG/WebP quality 1-100, PNG compression 0-9) and an optional limit on the
+# longest side in pixels. The format follows the file extension.
+def make_target(path, quality=None, compression=None, max_size=None):
+    return {'path': path, 'quality': quality, 'compression': compression, 'max_size': max_size}
+
+
+def deliverable_targets(directory, stem, quality=JPEG_QUALITY, compression=PNG_COMPRESSION, sizes=()):
+    # A full-size PNG, a full-size JPEG and one downscaled JPEG per size
+    targets = [make_target(os.path.join(directory, f"{stem}.png"), compression=compression),
+               make_target(os.path.join(directory, f"{stem}.jpg"), quality=quality)]
+    for size in sizes:
+        targets.append(make_target(os.path.join(directory, f"{stem}_{size}.jpg"), quality=quality, max_size=size))
+    return targets
+
+
+def encode_params(extension, quality=None, compression=None):
+    if extension in ('.jpg', '.jpeg'):
+        return [cv2.IMWRITE_JPEG_QUALITY, int(quality or JPEG_QUALITY)]
+    if extension == '.webp':
+        return [cv2.IMWRITE_WEBP_QUALITY, int(quality or JPEG_QUALITY)]
+    if extension == '.png':
+        return [cv2.IMWRITE_PNG_COMPRESSION, int(PNG_COMPRESSION if compression is None else compression)]
+    return []
+
+
+def fit_longest_side(image, max_size):
+    height, width = image.shape[:2]
+    if not max_size or max(width, height) <= max_size:
+        return image
+    ratio = max_size / max(width, height)
+    return cv2.resize(image, (max(1, round(width * ratio)), max(1, round(height * ratio))), interpolation=cv2.INTER_AREA)
+
+
+def new_file_mode(directory):
+    # The mode a new file gets under the process umask. os.umask can only read it by setting
+    # it, which would affect files other threads create meanwhile.
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('Umask:'):
+                    return 0o666 & ~int(line.split()[1], 8)
+    except OSError:
+        pass
+    # Elsewhere, create a file and see what mode it got
+    fd, probe = tempfile.mkstemp(dir=directory)
+    os.close(fd)
+    try:
+        os.remove(probe)
+        fd = os.open(probe, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666)
+        os.close(fd)
+        return os.stat(probe).st_mode & 0o777
+    finally:
+        os.remove(probe)
+
+
+def replace_file(temporary, path):
+    # mkstemp makes files only the owner can read. The result gets the mode of the file it
+    # replaces, or the mode a new file would get, as when writing the destination directly.
+    try:
+        mode = os.stat(path).st_mode & 0o7777
+    except FileNotFoundError:
+        mode = new_file_mode(os.path.dirname(os.path.abspath(path)))
+    os.chmod(temporary, mode)
+    os.replace(temporary, path)
+
+
+def write_target(image, target):
+    # Encodes into a temporary file next to the destination and renames it into place, so
+    # the destination is either the old file or the complete new one
+    start = time.perf_counter()
+    path = target['path']
+    extension = os.path.splitext(path)[1].lower()
+    image = fit_longest_side(image, target.get('max_size'))
+    directory, name = os.path.split(os.path.abspath(path))
+    params = encode_params(extension, target.get('quality'), target.get('compression'))
+    fd, temporary = tempfile.mkstemp(prefix=f".{name}.", suffix=extension, dir=directory)
+    os.close(fd)
+    encode_start = time.perf_counter()
+    try:
+        if tiles.is_tiled(image) and extension == '.png' and image.dtype == np.uint8:
+            written = tiles.write_png(temporary, image, level=params[1])
+        else:
+            written = cv2.imwrite(temporary, image, params)
+        if not written:
+            raise ValueError(f"Failed to write image: {path}")
+        encode_seconds = time.perf_counter() - encode_start
+        replace_file(temporary, path)
+    except BaseException:
+        os.remove(temporary)
+        raise
+    height, width = image.shape[:2]
+    return {'path': path, 'megapixels': width * height / 1e6, 'seconds': time.perf_counter() - start,
+            'encode_seconds': encode_seconds, 'bytes': os.path.getsize(path)}
+
+
+def export(image, targets, workers=None, progress=None):
+    # Writes every target from the same image in parallel; OpenCV's encoders release the GIL.
+    # progress(done, total, result) is called as each target finishes.
+    results = []
+    with ThreadPoolExecutor(max_workers=max(1, min(workers or WORKERS, len(targets))), thread_name_prefix='export') as executor:
+        futures = [executor.submit(write_target, image, target) for target in targets]
+        for future in as_completed(futures):
+            results.append(future.result())
+            if progress:
+                progress(len(results), len(targets), results[-1])
+    order = {target['path']: i for i, target in enumerate(targets)}
+    return sorted(results, key=lambda result: order[result['path']])
+
+
+def describe(result):
+    # Encode throughput leaves out the time spent resizing
+    megapixels, encode_seconds = result['megapixels'], result['encode_seconds']
+    return (f"{os.path.basename(result['path'])}: {megapixels:.1f} MP in {result['seconds']:.2f} s "
+            f"(encoded at {megapixels / encode_seconds if encode_seconds else float('inf'):.1f} MP/s, "
+            f"{result['bytes'] / 1e6:.1f} MB)")
+
+
+class ExportJob:
+    # Runs an export on a background thread and reports progress and the results on the Tk
+    # thread by polling with master.after(), since Tk must not be touched from other threads
+    def __init__(self, master, image, targets, on_progress, on_done, on_error, poll_interval=50):
+        self.master = master
+        self.poll_interval = poll_interval
+        self.callbacks = (on_progress, on_done, on_error)
+        self.messages = queue.Queue()
+        self.running = True
+        threading.Thread(target=self.work, args=(image, targets), name="export", daemon=True).start()
+        self.master.after(self.poll_interval, self.poll)
+
+    def work(self, image, targets):
+        try:
+            results = export(image, targets, progress=lambda done, total, result: self.messages.put((0, (done, total))))
+            self.messages.put((1, results))
+        except Exception as e:
+            self.messages.put((2, e))
+
+    def poll(self):
+        while True:
+            try:
+                kind, message = self.messages.get_nowait()
+            except queue.Empty:
+                break
+            if kind:
+                self.running = False
+            self.callbacks[kind](message)
+        if self.running:
+            self.master.after(self.poll_interval, self.poll)
@@ -0,0 +1,70 @@
+import importlib
+import os
+import threading
+
+# Installed packages add filters through this entry-point group. Each entry point names a
+# function that is called with `register`, e.g. in a plugin's pyproject.toml:
+#   [project.entry-points."image_editor.filters"]
+#   vignette = "editor_vignette:register_filters"
+ENTRY_POINT_GROUP = 'image_editor.filters'
+# Comma-separated modules with a register_filters(register) function, for plugins that are
+# not installed as packages
+PLUGIN_MODULES = os.environ.get('EDITOR_PLUGINS', '')
+
+# Buttons of the Filters panel: the label and the pipeline operation it previews
+BUILTIN = [
+    ("Negative", 'negative'),
+    ("Black And White", 'black_and_white'),
+    ("Stylisation", 'stylisation'),
+    ("Sketch Effect", 'sketch'),
+    ("Emboss", 'emboss'),
+    ("Sepia", 'sepia'),
+    ("Binary Thresholding", 'binary_threshold'),
+    ("Erosion", 'erosion'),
+    ("Dilation", 'dilation'),
+]
+
+registry = []
+errors = []  # Plugins that failed to load, with the reason
+loaded = False
+lock = threading.Lock()
+
+
+def register(name, function=None, label=None, footprint=None):
+    # Called by plugins. A function becomes a pipeline operation taking (image, value, scale),
+    # so recipes using it replay in the batch and clip commands too. A footprint (pixels, or
+    # a function of the value) lets it run tile by tile on large images. A label adds a
+    # button to the Filters panel.
+    if function is not None:
+        import pipeline
+        pipeline.OPERATIONS[name] = function
+        if footprint is not None:
+            pipeline.FOOTPRINTS[name] = footprint if callable(footprint) else lambda value, footprint=footprint: footprint
+    if label:
+        registry.append((label, name))
+
+
+def plugins():
+    # (name, function returning the plugin's register function) for every plugin found
+    from importlib import metadata
+    for entry_point in metadata.entry_points(group=ENTRY_POINT_GROUP):
+        yield entry_point.name, entry_point.load
+    for module in PLUGIN_MODULES.split(','):
+        if module.strip():
+            yield module.strip(), lambda module=module.strip(): importlib.import_module(module).register_filters
+
+
+def load():
+    # The built-in filters and every plugin, loaded on first use. A plugin that fails to
+    # load is left out and recorded in errors.
+    global loaded
+    with lock:
+        if not loaded:
+            loaded = True
+            registry.extend(BUILTIN)
+            for name, plugin in plugins():
+                try:
+                    plugin()(register)
+                except Exception as e:
+                    errors.append(f"{name}: {e}")
+    return registry
@@ -0,0 +1,301 @@
+import argparse
+import atexit
+import math
+import os
+import queue
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from PIL import GifImagePlugin, Image, ImageSequence
+
+import export
+import pipeline
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv')
+CLIP_EXTENSIONS = ('.gif',) + VIDEO_EXTENSIONS
+# Codecs that OpenCV's FFmpeg backend can write without extra libraries
+FOURCC = {'.mp4': 'mp4v', '.mov': 'mp4v', '.avi': 'MJPG', '.mkv': 'XVID'}
+
+WORKERS = int(os.environ.get('EDITOR_FRAME_WORKERS', os.cpu_count() or 1))
+# Memory budget for the display-size frames used to scrub through a clip
+PROXY_BUDGET_MB = int(os.environ.get('EDITOR_PROXY_MB', 128))
+
+
+# Decoding
+def is_clip(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension in VIDEO_EXTENSIONS:
+        return True
+    if extension == '.gif':
+        with Image.open(path) as image:
+            return getattr(image, 'n_frames', 1) > 1
+    return False
+
+
+def probe(path):
+    # Frame count, frame rate and frame size. Video containers only estimate the frame count.
+    if os.path.splitext(path)[1].lower() == '.gif':
+        with Image.open(path) as image:
+            count = getattr(image, 'n_frames', 1)
+            durations = []
+            for frame in ImageSequence.Iterator(image):
+                durations.append(frame.info.get('duration') or 100)
+            width, height = image.size
+        return {'frames': count, 'fps': 1000 * count / sum(durations), 'width': width, 'height': height}
+    capture = cv2.VideoCapture(path)
+    try:
+        if not capture.isOpened():
+            raise ValueError(f"Failed to open clip: {path}")
+        return {'frames': max(0, int(capture.get(cv2.CAP_PROP_FRAME_COUNT))), 'fps': capture.get(cv2.CAP_PROP_FPS) or 25,
+                'width': int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)), 'height': int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))}
+    finally:
+        capture.release()
+
+
+def read_frames(path):
+    # BGR frames one at a time, decoded only as they are asked for
+    if os.path.splitext(path)[1].lower() == '.gif':
+        with Image.open(path) as image:
+            for frame in ImageSequence.Iterator(image):
+                yield cv2.cvtColor(np.asarray(frame.convert('RGB')), cv2.COLOR_RGB2BGR)
+        return
+    capture = cv2.VideoCapture(path)
+    try:
+        if not capture.isOpened():
+            raise ValueError(f"Failed to open clip: {path}")
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            yield frame
+    finally:
+        capture.release()
+
+
+def first_frame(path):
+    frames = read_frames(path)
+    try:
+        return next(frames, None)
+    finally:
+        frames.close()
+
+
+def prefetch(frames, depth):
+    # Decodes on its own thread at most `depth` frames ahead of the consumer
+    items = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def read():
+        try:
+            for frame in frames:
+                if not put((0, frame)):
+                    return
+            put((1, None))
+        except Exception as e:
+            put((2, e))
+        finally:
+            frames.close()
+
+    threading.Thread(target=read, name="frame-reader", daemon=True).start()
+    try:
+        while True:
+            kind, item = items.get()
+            if kind == 1:
+                return
+            if kind == 2:
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+def map_ordered(function, items, workers, depth):
+    # Yields function(item) for every item in order, with at most `depth` items submitted
+    # to the pool and not yet handed on, so a slow consumer holds back the decoder
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='frames') as executor:
+        pending = deque()
+        try:
+            for item in items:
+                pending.append(executor.submit(function, item))
+                if len(pending) >= depth:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+# Encoding
+class GifWriter:
+    # Writes a GIF a frame at a time, each frame with its own palette, so memory does not grow
+    # with the clip. Pillow's GIF writer keeps every frame until the file is closed.
+    def __init__(self, path, fps, loop=0):
+        self.file = open(path, 'wb')
+        self.duration = max(20, int(round(1000 / fps)))
+        self.loop = loop
+        self.started = False
+
+    def write(self, frame):
+        image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)).quantize(256)
+        if not self.started:
+            header, _ = GifImagePlugin.getheader(image.copy(), info={'loop': self.loop, 'duration': self.duration})
+            self.file.write(b''.join(header))
+            self.started = True
+        self.file.write(b''.join(GifImagePlugin.getdata(image, duration=self.duration, include_color_table=True)))
+
+    def release(self):
+        if self.started:
+            self.file.write(b';')
+        self.file.close()
+
+
+def open_writer(path, fps, width, height):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.gif':
+        return GifWriter(path, fps)
+    if extension not in FOURCC:
+        raise ValueError(f"Unsupported clip format: {extension}")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*FOURCC[extension]), fps, (width, height))
+    if not writer.isOpened():
+        raise ValueError(f"Failed to write clip: {path}")
+    return writer
+
+
+def process_clip(source, destination, steps, workers=None, progress=None):
+    # Streams frames from decoder to encoder, applying the steps on a pool of threads. At most
+    # two frames per worker are decoded ahead and two per worker are in the pool, so memory
+    # stays flat however long the clip is. progress(done, total, fps) follows each frame.
+    # Like an export, the clip is written to a temporary file that replaces the destination.
+    start = time.perf_counter()
+    info = probe(source)
+    workers = workers or WORKERS
+    results = map_ordered(lambda frame: np.ascontiguousarray(pipeline.run(frame, steps)),
+                          prefetch(read_frames(source), 2 * workers), workers, 2 * workers)
+    directory, name = os.path.split(os.path.abspath(destination))
+    fd, temporary = tempfile.mkstemp(prefix=f".{name}.", suffix=os.path.splitext(name)[1], dir=directory)
+    os.close(fd)
+    writer = None
+    count = 0
+    try:
+        try:
+            for frame in results:
+                if writer is None:
+                    writer = open_writer(temporary, info['fps'], frame.shape[1], frame.shape[0])
+                writer.write(frame)
+                count += 1
+                if progress:
+                    progress(count, max(count, info['frames']), count / (time.perf_counter() - start))
+        finally:
+            results.close()
+            if writer is not None:
+                writer.release()
+        if not count:
+            raise ValueError(f"Failed to read any frames: {source}")
+        export.replace_file(temporary, destination)
+    except BaseException:
+        os.remove(temporary)
+        raise
+    seconds = time.perf_counter() - start
+    height, width = frame.shape[:2]
+    return {'path': destination, 'frames': count, 'seconds': seconds, 'fps': count / seconds,
+            'megapixels': width * height / 1e6}
+
+
+def describe(result):
+    return (f"{os.path.basename(result['path'])}: {result['frames']} frames in {result['seconds']:.2f} s "
+            f"({result['fps']:.1f} fps, {result['fps'] * result['megapixels']:.1f} MP/s)")
+
+
+class ProxyFrames:
+    # Display-size copies of a clip's frames for scrubbing, decoded on a background thread.
+    # If all of them would take more than budget_bytes, only every `stride`-th frame is kept
+    # and a frame in between shows the kept one before it.
+    def __init__(self, path, max_width, max_height, budget_bytes=PROXY_BUDGET_MB * 1024 * 1024):
+        info = probe(path)
+        self.path = path
+        self.count = max(1, info['frames'])
+        self.size = pipeline.fit_size(info['width'], info['height'], max_width, max_height)
+        self.scale = info['height'] / self.size[1]
+        self.stride = max(1, math.ceil(self.count * self.size[0] * self.size[1] * 3 / budget_bytes))
+        self.frames = {}
+        self.done = False
+        self.cancelled = threading.Event()
+        self.thread = threading.Thread(target=self.work, args=(path,), name="proxy-frames", daemon=True)
+        self.thread.start()
+        # A decoder still running while the interpreter shuts down aborts the process
+        atexit.register(self.cancel)
+
+    def work(self, path):
+        frames = read_frames(path)
+        index = -1
+        try:
+            for index, frame in enumerate(frames):
+                if self.cancelled.is_set():
+                    return
+                if index % self.stride == 0:
+                    self.frames[index] = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+            # Containers can misreport the frame count
+            self.count = max(1, index + 1)
+        finally:
+            frames.close()
+            self.done = True
+
+    def get(self, index):
+        # The nearest decoded frame at or before index and its index, or None before the first
+        index -= index % self.stride
+        while index >= 0 and index not in self.frames:
+            index -= self.stride
+        return (index, self.frames[index]) if index >= 0 else None
+
+    def cancel(self):
+        # Stops decoding after the current frame and drops the frames
+        self.cancelled.set()
+        self.thread.join()
+        self.frames = {}
+        atexit.unregister(self.cancel)
+
+
+class ClipJob(export.ExportJob):
+    # Processes a clip on a background thread and reports on the Tk thread like an export
+    def __init__(self, master, source, destination, steps, on_progress, on_done, on_error, poll_interval=50):
+        self.steps = steps
+        super().__init__(master, source, destination, on_progress, on_done, on_error, poll_interval)
+
+    def work(self, source, destination):
+        try:
+            result = process_clip(source, destination, self.steps,
+                                  progress=lambda done, total, fps: self.messages.put((0, (done, total, fps))))
+            self.messages.put((1, result))
+        except Exception as e:
+            self.messages.put((2, e))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='app.py clip', description='Apply a saved edit recipe to every frame of a GIF or video.')
+    parser.add_argument('recipe', help='recipe file saved from the editor')
+    parser.add_argument('source')
+    parser.add_argument('destination', help='output file; .gif, .mp4, .mov, .avi or .mkv')
+    parser.add_argument('--workers', type=int, default=WORKERS, help='number of worker threads')
+    args = parser.parse_args(argv)
+
+    steps = pipeline.load_recipe(args.recipe)
+    # Frames are processed in parallel already
+    pipeline.parallel.WORKERS = 1
+    result = process_clip(args.source, args.destination, steps, workers=args.workers)
+    print(describe(result))
+    return 0
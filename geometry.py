@@ -0,0 +1,165 @@
+import math
+
+import cv2
+import numpy as np
+
+import tiles
+
+
+# Rotations, flips and crops are composed into one affine transform before any pixel moves.
+# A transform maps source pixel centres to the pixel centres of an output of `size` =
+# (width, height); a crop only shrinks the output, so what it cuts away is never computed.
+# Quarter turns, flips and crops resolve to numpy views; anything else to one warpAffine.
+class Transform:
+    def __init__(self, width, height, matrix=None):
+        self.size = (width, height)
+        self.matrix = np.eye(3) if matrix is None else matrix
+
+    def then(self, matrix, width, height):
+        return Transform(width, height, snap(np.vstack([matrix, [0, 0, 1]]) @ self.matrix))
+
+    def is_view(self):
+        return view_layout(self.matrix) is not None
+
+    def source_box(self, box):
+        # The (x0, y0, x1, y1) box of source pixels that output pixels box are computed from
+        x0, y0, x1, y1 = box
+        corners = snap(np.linalg.inv(self.matrix))[:2] @ [[x0, x1 - 1, x0, x1 - 1], [y0, y0, y1 - 1, y1 - 1], [1, 1, 1, 1]]
+        # Bilinear sampling reads one more pixel on every side
+        margin = 0 if self.is_view() else 1
+        sx0, sy0 = np.floor(corners.min(axis=1)).astype(int) - margin
+        sx1, sy1 = np.ceil(corners.max(axis=1)).astype(int) + 1 + margin
+        return int(sx0), int(sy0), int(sx1), int(sy1)
+
+
+def snap(matrix, tolerance=1e-9):
+    # Rounds away the floating-point noise of sines and inverses, so a rotation by 90 degrees
+    # is recognised as a quarter turn
+    matrix = np.asarray(matrix, dtype=np.float64)
+    rounded = np.round(matrix)
+    return np.where(np.abs(matrix - rounded) < tolerance, rounded, matrix)
+
+
+def rotate_left(transform, value=None, scale=1):
+    width, height = transform.size
+    return transform.then([[0, 1, 0], [-1, 0, width - 1]], height, width)
+
+
+def rotate_right(transform, value=None, scale=1):
+    width, height = transform.size
+    return transform.then([[0, -1, height - 1], [1, 0, 0]], height, width)
+
+
+def flip_vertical(transform, value=None, scale=1):
+    width, height = transform.size
+    return transform.then([[1, 0, 0], [0, -1, height - 1]], width, height)
+
+
+def flip_horizontal(transform, value=None, scale=1):
+    width, height = transform.size
+    return transform.then([[-1, 0, width - 1], [0, 1, 0]], width, height)
+
+
+def crop(transform, value, scale=1):
+    # Same bounds as slicing the image with the scaled points
+    width, height = transform.size
+    x0, x1, _ = slice(int(value[0] / scale), int(value[2] / scale)).indices(width)
+    y0, y1, _ = slice(int(value[1] / scale), int(value[3] / scale)).indices(height)
+    return transform.then([[1, 0, -x0], [0, 1, -y0]], max(0, x1 - x0), max(0, y1 - y0))
+
+
+def rotate(transform, value, scale=1):
+    # Counterclockwise by `value` degrees about the centre, on a canvas that holds the whole
+    # rotated image
+    width, height = transform.size
+    radians = math.radians(float(value))
+    cos, sin = snap([math.cos(radians), math.sin(radians)])
+    new_width = max(1, math.ceil(abs(width * cos) + abs(height * sin) - 1e-6))
+    new_height = max(1, math.ceil(abs(width * sin) + abs(height * cos) - 1e-6))
+    cx, cy = (width - 1) / 2, (height - 1) / 2
+    return transform.then([[cos, sin, (new_width - 1) / 2 - cos * cx - sin * cy],
+                           [-sin, cos, (new_height - 1) / 2 + sin * cx - cos * cy]], new_width, new_height)
+
+
+OPERATIONS = {
+    'rotate_left': rotate_left,
+    'rotate_right': rotate_right,
+    'flip_vertical': flip_vertical,
+    'flip_horizontal': flip_horizontal,
+    'crop': crop,
+    'rotate': rotate,
+}
+
+
+def compose(width, height, steps, scale=1):
+    transform = Transform(width, height)
+    for step in steps:
+        transform = OPERATIONS[step['op']](transform, step['value'], scale)
+    return transform
+
+
+def translated(transform, box, offset):
+    # `transform` restricted to the output pixels in box, for a source whose top-left pixel
+    # is at `offset` in the original source
+    x0, y0, x1, y1 = box
+    shift = transform.then([[1, 0, -x0], [0, 1, -y0]], x1 - x0, y1 - y0)
+    return Transform(x1 - x0, y1 - y0, snap(shift.matrix @ [[1, 0, offset[0]], [0, 1, offset[1]], [0, 0, 1]]))
+
+
+def apply(image, steps, scale=1):
+    height, width = image.shape[:2]
+    return resolve(image, compose(width, height, steps, scale))
+
+
+def resolve(image, transform):
+    width, height = transform.size
+    if not width or not height:
+        return np.empty((height, width) + image.shape[2:], image.dtype)
+    layout = view_layout(transform.matrix)
+    if layout is None:
+        return warp(image, transform.matrix[:2], transform.size)
+    view = strided(image, layout, width, height)
+    if tiles.is_tiled(image) and (layout[0][0] != 1 or layout[1][1] != 1):
+        # Turned or flipped views of a scratch file would be read across the file for every
+        # tile, so they are copied once
+        return tiles.materialize(view)
+    return view
+
+
+def view_layout(matrix):
+    # ((p, q, tx), (r, s, ty)) with source x = p * x' + q * y' + tx and y = r * x' + s * y' + ty
+    # when output pixels are source pixels moved by whole steps, otherwise None
+    inverse = snap(np.linalg.inv(matrix))[:2]
+    if not np.array_equal(inverse, np.round(inverse)):
+        return None
+    (p, q, tx), (r, s, ty) = inverse.astype(int).tolist()
+    if {abs(p), abs(s)} == {1} and q == r == 0 or {abs(q), abs(r)} == {1} and p == s == 0:
+        return (p, q, tx), (r, s, ty)
+    return None
+
+
+def take(array, axis, start, step, length):
+    # `length` elements along `axis` from `start`, going forwards or backwards
+    index = [slice(None)] * array.ndim
+    index[axis] = slice(start, start + length) if step > 0 else slice(start - length + 1, start + 1)
+    array = array[tuple(index)]
+    return array if step > 0 else np.flip(array, axis)
+
+
+def strided(image, layout, width, height):
+    (p, q, tx), (r, s, ty) = layout
+    if p == 0:
+        # Output rows run along source columns
+        return take(take(image.swapaxes(0, 1), 0, tx, q, height), 1, ty, r, width)
+    return take(take(image, 0, ty, s, height), 1, tx, p, width)
+
+
+def warp(image, matrix, size):
+    # One bilinear resample; corners from outside the source are black
+    if not tiles.is_tiled(image):
+        return cv2.warpAffine(image, matrix, size, flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT)
+    # Scratch images are warped in one call from the mapped file into a new one: warping tile
+    # by tile moves the matrix, which rounds sample positions differently from `batch`
+    width, height = size
+    out = tiles.scratch((height, width) + image.shape[2:], image.dtype)
+    return cv2.warpAffine(image, matrix, size, dst=out, flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT)
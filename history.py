@@ -0,0 +1,143 @@
+import atexit
+import os
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+import pipeline
+
+
+class SnapshotStore:
+    # Full-resolution snapshots keyed by history position, evicted least recently used first
+    # once their size exceeds budget_bytes. With compress, snapshots are kept zlib-compressed;
+    # with spill_dir, evicted snapshots are written there instead of being dropped.
+    def __init__(self, budget_bytes, compress=False, spill_dir=None):
+        self.budget_bytes = budget_bytes
+        self.compress = compress
+        self.spill_dir = spill_dir
+        self.entries = OrderedDict()
+        self.spilled = {}
+        self.memory_bytes = 0
+        self.disk_bytes = 0
+        self.lock = threading.Lock()
+        if spill_dir is not None:
+            # Spilled snapshots are only needed while the editor runs
+            atexit.register(self.clear)
+
+    def put(self, key, image):
+        if self.compress:
+            entry = ('zlib', zlib.compress(np.ascontiguousarray(image).tobytes(), 1), image.shape, image.dtype)
+            nbytes = len(entry[1])
+        else:
+            entry = ('raw', image, image.shape, image.dtype)
+            nbytes = image.nbytes
+        with self.lock:
+            self.remove(key)
+            self.entries[key] = (entry, nbytes)
+            self.memory_bytes += nbytes
+            while self.memory_bytes > self.budget_bytes and len(self.entries) > 1:
+                old_key, (old_entry, old_nbytes) = self.entries.popitem(last=False)
+                self.memory_bytes -= old_nbytes
+                if self.spill_dir is not None:
+                    self.spill(old_key, old_entry)
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                (kind, payload, shape, dtype), nbytes = self.entries[key]
+            elif key in self.spilled:
+                return np.load(self.spilled[key])
+            else:
+                return None
+        if kind == 'zlib':
+            return np.frombuffer(zlib.decompress(payload), dtype=dtype).reshape(shape)
+        return payload
+
+    def keys(self):
+        with self.lock:
+            return set(self.entries) | set(self.spilled)
+
+    def spill(self, key, entry):
+        kind, payload, shape, dtype = entry
+        if kind == 'zlib':
+            payload = np.frombuffer(zlib.decompress(payload), dtype=dtype).reshape(shape)
+        fd, path = tempfile.mkstemp(suffix='.npy', dir=self.spill_dir)
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, payload)
+        self.spilled[key] = path
+        self.disk_bytes += os.path.getsize(path)
+
+    def remove(self, key):
+        if key in self.entries:
+            entry, nbytes = self.entries.pop(key)
+            self.memory_bytes -= nbytes
+        if key in self.spilled:
+            path = self.spilled.pop(key)
+            self.disk_bytes -= os.path.getsize(path)
+            os.remove(path)
+
+    def discard_after(self, position):
+        with self.lock:
+            for key in [key for key in list(self.entries) + list(self.spilled) if key > position]:
+                self.remove(key)
+
+    def clear(self):
+        self.discard_after(-1)
+
+
+class History:
+    # Each applied change is stored as a command (the list of pipeline steps it applied).
+    # A snapshot is kept every `interval` commands; any other position is rebuilt by
+    # replaying commands from the nearest snapshot at or before it.
+    def __init__(self, base_image, store, interval=5):
+        self.base_image = base_image
+        self.store = store
+        self.interval = interval
+        self.commands = []
+        self.position = 0
+        self.last_latency = 0
+        store.clear()
+
+    def push(self, steps, image):
+        del self.commands[self.position:]
+        self.store.discard_after(self.position)
+        self.commands.append(list(steps))
+        self.position += 1
+        if self.position % self.interval == 0:
+            self.store.put(self.position, image)
+
+    def can_undo(self):
+        return self.position > 0
+
+    def can_redo(self):
+        return self.position < len(self.commands)
+
+    def move(self, position):
+        self.position = max(0, min(position, len(self.commands)))
+        return self.position
+
+    def render(self, position):
+        start = time.perf_counter()
+        keys = [key for key in self.store.keys() if key <= position]
+        image = None
+        while keys and image is None:
+            snapshot = max(keys)
+            keys.remove(snapshot)
+            image = self.store.get(snapshot)
+        if image is None:
+            snapshot, image = 0, self.base_image
+        # Replayed as one run, so crops and rotations are composed across commands
+        image = pipeline.run(image, [step for command in self.commands[snapshot:position] for step in command])
+        if position != snapshot and position > 0:
+            # Keep the replayed result so stepping back and forth stays cheap
+            self.store.put(position, image)
+        self.last_latency = time.perf_counter() - start
+        return image
+
+    def steps(self):
+        return [step for command in self.commands[:self.position] for step in command]
@@ -0,0 +1,114 @@
+import queue
+import threading
+import time
+
+import frames
+import tiles
+import tracing
+
+
+def reduction_for(width, height, max_width, max_height):
+    # Largest JPEG decode reduction that still has a pixel per canvas pixel when the image is
+    # fitted into max_width x max_height
+    fit = min(1, max_width / width, max_height / height)
+    for reduction in (8, 4, 2):
+        if reduction * fit <= 1:
+            return reduction
+    return 1
+
+
+def first_paint(path, max_width, max_height):
+    # A quick reduced-resolution decode, with the number of full-resolution pixels per pixel
+    # and the full size. None when the format cannot decode reduced images faster than the
+    # whole image, or the image is small enough already.
+    width, height, file_format, orientation = tiles.read_header(path)
+    if file_format != 'JPEG':
+        return None
+    reduction = reduction_for(width, height, max_width, max_height)
+    if reduction == 1:
+        return None
+    image = tiles.read_image(path, reduction, orientation)
+    if image is None:
+        return None
+    return image.copy(), height / image.shape[0], (width, height)
+
+
+class ImageLoader:
+    # Loads one file at a time on its own thread: a reduced decode for the first paint, then
+    # the full image with its decode time and, for a clip, its ProxyFrames. Starting another
+    # load cancels the current one; its results are dropped and a tiled copy still in
+    # progress stops at the next tile. Like RenderScheduler, results are handed back on the
+    # Tk thread by polling with master.after().
+    def __init__(self, master, poll_interval=15):
+        self.master = master
+        self.poll_interval = poll_interval
+        self.generation = 0
+        self.cancelled = threading.Event()
+        self.results = queue.Queue()
+        self.polling = False
+
+    def load(self, path, tiled_pixels, preview_size, on_preview, on_image, on_error):
+        self.cancel()
+        self.cancelled = threading.Event()
+        self.callbacks = (on_preview, on_image, on_error)
+        thread = threading.Thread(target=self.work, args=(self.generation, self.cancelled, path, tiled_pixels, preview_size),
+                                  name="image-loader", daemon=True)
+        thread.start()
+        if not self.polling:
+            self.polling = True
+            self.master.after(self.poll_interval, self.poll)
+
+    def cancel(self):
+        self.generation += 1
+        self.cancelled.set()
+
+    def work(self, generation, cancelled, path, tiled_pixels, preview_size):
+        try:
+            if frames.is_clip(path):
+                # Animations and videos are edited on their first frame, which is shown while
+                # the clip is probed and its scrubbing frames start decoding
+                start = time.perf_counter()
+                with tracing.span('load.decode'):
+                    image = frames.first_frame(path)
+                seconds = time.perf_counter() - start
+                clip = None
+                if image is not None:
+                    self.results.put((generation, 0, (image, 1, (image.shape[1], image.shape[0]))))
+                    with tracing.span('load.probe'):
+                        clip = frames.ProxyFrames(path, *preview_size)
+                if cancelled.is_set():
+                    if clip is not None:
+                        clip.cancel()
+                    return
+                self.results.put((generation, 1, (image, seconds, clip)))
+                return
+            with tracing.span('load.preview'):
+                preview = first_paint(path, *preview_size)
+            if preview is not None and not cancelled.is_set():
+                self.results.put((generation, 0, preview))
+            start = time.perf_counter()
+            with tracing.span('load.decode'):
+                image = tiles.load_image(path, tiled_pixels, cancelled)
+            if not cancelled.is_set():
+                self.results.put((generation, 1, (image, time.perf_counter() - start, None)))
+        except Exception as e:
+            self.results.put((generation, 2, e))
+
+    def poll(self):
+        done = False
+        while True:
+            try:
+                generation, stage, result = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if generation != self.generation:
+                if stage == 1 and result[2] is not None:
+                    # The clip of a cancelled load stops decoding its frames
+                    result[2].cancel()
+                continue
+            done = stage > 0
+            self.callbacks[stage](result)
+        if done:
+            self.polling = False
+        else:
+            self.master.after(self.poll_interval, self.poll)
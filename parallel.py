@@ -0,0 +1,142 @@
+import argparse
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+WORKERS = int(os.environ.get('EDITOR_WORKERS', os.cpu_count() or 1))
+BACKEND = os.environ.get('EDITOR_PARALLEL_BACKEND', 'thread')
+# Images smaller than this are not worth splitting
+MIN_PIXELS = float(os.environ.get('EDITOR_PARALLEL_MP', 4)) * 1e6
+# Compare every banded result with a single call on the whole image
+VERIFY = os.environ.get('EDITOR_VERIFY_PARALLEL') == '1'
+
+executors = {}
+
+
+def get_executor(backend, workers):
+    key = (backend, workers)
+    if key not in executors:
+        if backend == 'process':
+            executors[key] = ProcessPoolExecutor(max_workers=workers, initializer=init_process)
+        else:
+            executors[key] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='band')
+    return executors[key]
+
+
+def init_process():
+    import cv2
+    # Bands already keep every core busy
+    cv2.setNumThreads(1)
+
+
+def band_spans(height, count, align=1):
+    step = -(-height // (count * align)) * align
+    return [(y, min(y + step, height)) for y in range(0, height, step)]
+
+
+def process_band(function, image, out, span, overlap):
+    y0, y1 = span
+    top, bottom = max(0, y0 - overlap), min(image.shape[0], y1 + overlap)
+    result = function(np.ascontiguousarray(image[top:bottom]))
+    out[y0:y1] = result[y0 - top:y1 - top]
+
+
+def attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13 attaching also registers the block with the resource tracker
+        # shared with the parent, which unregisters it again when it unlinks the block
+        return shared_memory.SharedMemory(name=name)
+
+
+def process_shared_band(function, source_name, out_name, shape, dtype, span, overlap):
+    source, out = attach(source_name), attach(out_name)
+    try:
+        image = np.ndarray(shape, dtype, buffer=source.buf)
+        result = np.ndarray(shape, dtype, buffer=out.buf)
+        process_band(function, image, result, span, overlap)
+        del image, result
+    finally:
+        source.close()
+        out.close()
+
+
+def run_banded(function, image, overlap, workers=None, backend=None, align=1):
+    # Splits the image into one horizontal band per worker, each padded with `overlap` rows
+    # of context, and joins the centres. For operations whose footprint fits in the overlap
+    # the joined result is identical to function(image). The operation must keep the
+    # image's shape and dtype. Bands with their context start on a multiple of `align` rows,
+    # for operations that work on blocks of pixels.
+    workers = workers or WORKERS
+    backend = backend or BACKEND
+    if workers <= 1 or image.shape[0] < 2 * workers:
+        return function(image)
+    overlap = -(-overlap // align) * align
+    spans = band_spans(image.shape[0], workers, align)
+    executor = get_executor(backend, workers)
+    if backend == 'process':
+        out = run_processes(executor, function, image, overlap, spans)
+    else:
+        out = np.empty_like(image)
+        for future in [executor.submit(process_band, function, image, out, span, overlap) for span in spans]:
+            future.result()
+    if VERIFY:
+        difference = compare(out, function(image))
+        if difference:
+            warnings.warn(f"Banded {getattr(function, 'func', function).__name__} differs from a single call by up to {difference}")
+    return out
+
+
+def run_processes(executor, function, image, overlap, spans):
+    source = shared_memory.SharedMemory(create=True, size=max(1, image.nbytes))
+    out = shared_memory.SharedMemory(create=True, size=max(1, image.nbytes))
+    try:
+        np.ndarray(image.shape, image.dtype, buffer=source.buf)[:] = image
+        futures = [executor.submit(process_shared_band, function, source.name, out.name, image.shape, image.dtype.str, span, overlap)
+                   for span in spans]
+        for future in futures:
+            future.result()
+        result = np.ndarray(image.shape, image.dtype, buffer=out.buf).copy()
+    finally:
+        source.close()
+        source.unlink()
+        out.close()
+        out.unlink()
+    return result
+
+
+def compare(first, second):
+    return int(np.abs(first.astype(np.int32) - second.astype(np.int32)).max()) if first.size else 0
+
+
+def main(argv=None):
+    import blur
+    import pipeline
+
+    parser = argparse.ArgumentParser(prog='app.py check-parallel',
+                                     description='Compare banded results of the parallel filters with single calls.')
+    parser.add_argument('--megapixels', type=float, default=12)
+    parser.add_argument('--workers', type=int, default=WORKERS)
+    parser.add_argument('--backend', choices=['thread', 'process'], default=BACKEND)
+    args = parser.parse_args(argv)
+
+    image = pipeline.synthetic_image(args.megapixels)
+    steps = [pipeline.make_step(name, pipeline.SAMPLE_VALUES.get(name)) for name in sorted(pipeline.PARALLEL)]
+    # Blurs with kernels past EDITOR_FAST_BLUR, which work on blocks of pixels
+    large = 2 * max(blur.THRESHOLD, 32) + 1
+    steps += [pipeline.make_step(name, large) for name in ('gaussian_blur', 'median_blur')]
+    failed = False
+    for step in steps:
+        name, allowed = step['op'], pipeline.PARALLEL.get(step['op'], 0)
+        single = pipeline.OPERATIONS[name](image, step['value'])
+        banded = run_banded(pipeline.operation(step), image, pipeline.footprint(step), args.workers, args.backend,
+                            pipeline.block(step))
+        difference = compare(banded, single)
+        failed |= difference > allowed
+        print(f"{name} {step['value']}: {'identical' if not difference else f'differs by up to {difference}'} "
+              f"(allowed {allowed})")
+    return 1 if failed else 0
@@ -0,0 +1,575 @@
+import json
+import math
+import threading
+import time
+from functools import partial
+
+import cv2
+import numpy as np
+
+import blur
+import color
+import geometry
+import parallel
+import tiles
+import tracing
+
+RECIPE_VERSION = 1
+
+DISPLAY_WIDTH = 300
+DISPLAY_HEIGHT = 400
+
+
+def fit_size(width, height, max_width=DISPLAY_WIDTH, max_height=DISPLAY_HEIGHT):
+    ratio = height / width
+    new_width = width
+    new_height = height
+    if height > max_height or width > max_width:
+        if ratio < 1:
+            new_width = max_width
+            new_height = max(1, int(new_width * ratio))
+        else:
+            new_height = max_height
+            new_width = max(1, int(new_height / ratio))
+    return new_width, new_height
+
+
+# Every operation takes the image, a JSON-serialisable value and `scale`: the number of
+# full-resolution pixels per pixel of `image`. Values are always given in full-resolution
+# pixels, so the same step renders a display-resolution preview or the final image.
+# Operations never modify their input in place.
+def odd_kernel(value, scale=1):
+    value = int(round(int(value) / scale))
+    if value % 2 == 0:
+        value += 1
+    return value
+
+
+def scale_point(point, scale=1):
+    return int(point[0] / scale), int(point[1] / scale)
+
+
+# Blur Operations (large Gaussian kernels are approximated, see blur.py)
+def average_blur(image, value, scale=1):
+    return blur.box(image, odd_kernel(value, scale))
+
+
+def gaussian_blur(image, value, scale=1):
+    return blur.gaussian(image, odd_kernel(value, scale))
+
+
+def median_blur(image, value, scale=1):
+    return blur.median(image, odd_kernel(value, scale))
+
+
+# Adjust Operations
+def brightness(image, value, scale=1):
+    return cv2.convertScaleAbs(image, alpha=float(value))
+
+
+def saturation(image, value, scale=1):
+    return cv2.convertScaleAbs(image, beta=float(value))
+
+
+# Adjust panel: every slider of the panel in one step, applied as one tone lookup table
+# followed, when saturation is changed, by a pass in HSV
+ADJUST_DEFAULTS = {
+    'brightness': 1,
+    'offset': 0,
+    'contrast': 1,
+    'gamma': 1,
+    'shadows': 0,
+    'highlights': 0,
+    'saturation': 1,
+}
+
+
+def adjust_lut(value):
+    return color.tone_lut(**{key: value.get(key, default) for key, default in ADJUST_DEFAULTS.items() if key != 'saturation'})
+
+
+def adjust(image, value, scale=1):
+    lut = adjust_lut(value)
+    factor = value.get('saturation', 1)
+    if factor == 1:
+        return color.apply_lut(image, lut)
+    if np.array_equal(lut, color.IDENTITY):
+        # Only saturation changes, so the HSV conversion of the source can be shared
+        return color.saturate(image, factor, hsv=intermediate(image, 'hsv', color.to_hsv))
+    return color.saturate(color.apply_lut(image, lut), factor)
+
+
+def curves(image, value, scale=1):
+    return color.apply_lut(image, color.curve_lut(value))
+
+
+def lut_chain(image, value, scale=1):
+    return color.apply_lut(image, chain_lut(value))
+
+
+# Filter Operations
+def negative(image, value=None, scale=1):
+    return cv2.bitwise_not(image)
+
+
+def black_and_white(image, value=None, scale=1):
+    gray = intermediate(image, 'gray', lambda image: cv2.cvtColor(image, cv2.COLOR_BGR2GRAY))
+    return cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+
+
+def stylisation(image, value=None, scale=1):
+    return cv2.stylization(image, sigma_s=150 / scale, sigma_r=0.25)
+
+
+def sketch(image, value=None, scale=1):
+    gray, color = cv2.pencilSketch(image, sigma_s=60 / scale, sigma_r=0.5, shade_factor=0.02)
+    return color
+
+
+def emboss(image, value=None, scale=1):
+    kernel = np.array([[0, -1, -1], [1, 0, -1], [1, 1, 0]])
+    return cv2.filter2D(image, -1, kernel)
+
+
+def sepia(image, value=None, scale=1):
+    return color.apply_matrix(image, color.SEPIA)
+
+
+def binary_threshold(image, value=None, scale=1):
+    ret, image = cv2.threshold(image, 127, 255, cv2.THRESH_BINARY)
+    return image
+
+
+def erosion(image, value=None, scale=1):
+    size = odd_kernel(5, scale)
+    return cv2.erode(image, np.ones((size, size), np.uint8), iterations=1)
+
+
+def dilation(image, value=None, scale=1):
+    size = odd_kernel(5, scale)
+    return cv2.dilate(image, np.ones((size, size), np.uint8), iterations=1)
+
+
+# Rotate, Flip and Crop Operations. Quarter turns, flips and crops return views; `run` also
+# composes consecutive ones into one transform (see geometry.py).
+def rotate_left(image, value=None, scale=1):
+    return geometry.apply(image, [make_step('rotate_left')], scale)
+
+
+def rotate_right(image, value=None, scale=1):
+    return geometry.apply(image, [make_step('rotate_right')], scale)
+
+
+def flip_vertical(image, value=None, scale=1):
+    return geometry.apply(image, [make_step('flip_vertical')], scale)
+
+
+def flip_horizontal(image, value=None, scale=1):
+    return geometry.apply(image, [make_step('flip_horizontal')], scale)
+
+
+def rotate(image, value, scale=1):
+    return geometry.apply(image, [make_step('rotate', value)], scale)
+
+
+def crop(image, value, scale=1):
+    return geometry.apply(image, [make_step('crop', value)], scale)
+
+
+# Text and Draw Operations
+def text(image, value, scale=1):
+    return cv2.putText(tiles.copy(image), value['text'], scale_point(value['position'], scale), cv2.FONT_HERSHEY_SIMPLEX,
+                       value['font_size'] / scale, tuple(value['color']), max(1, int(5 / scale)))
+
+
+def draw_line(image, line, color, thickness, scale=1):
+    cv2.line(image, scale_point(line[:2], scale), scale_point(line[2:], scale), tuple(color),
+             thickness=max(1, int(thickness / scale)), lineType=cv2.LINE_AA)
+
+
+def draw(image, value, scale=1):
+    # Strokes recorded segment by segment, kept so older recipes still replay
+    image = tiles.copy(image)
+    for line in value['lines']:
+        draw_line(image, line, value['color'], value['thickness'], scale)
+    return image
+
+
+def stroke_points(value, scale=1):
+    points = np.array([scale_point(point, scale) for point in value['points']], dtype=np.int32).reshape(-1, 2)
+    if len(points) == 1:
+        # A click without movement leaves a dot
+        points = np.repeat(points, 2, axis=0)
+    return points, max(1, int(value['size'] / scale))
+
+
+def stroke_bounds(value, shape, scale=1):
+    # The (x0, y0, x1, y1) box a stroke can change, clipped to an image of the given shape
+    points, thickness = stroke_points(value, scale)
+    if not len(points):
+        return 0, 0, 0, 0
+    pad = thickness // 2 + 2
+    height, width = shape[:2]
+    x0, y0 = np.maximum(points.min(axis=0) - pad, 0)
+    x1, y1 = np.minimum(points.max(axis=0) + pad + 1, [width, height])
+    return int(x0), int(y0), int(max(x0, x1)), int(max(y0, y1))
+
+
+def drawable(image, shared=None):
+    # `image` if strokes can be drawn into it in place, otherwise a copy. Cached results are
+    # read-only, and OpenCV cannot draw into turned or flipped views.
+    if (not image.flags.writeable or not image.flags.c_contiguous
+            or shared is not None and np.may_share_memory(image, shared)):
+        return tiles.copy(image)
+    return image
+
+
+def draw_stroke(image, value, scale=1):
+    # Draws a brush stroke into `image` in place as one anti-aliased polyline. Only the
+    # stroke's bounding box is touched, which is also all that is blended for opacity.
+    x0, y0, x1, y1 = stroke_bounds(value, image.shape, scale)
+    if x0 >= x1 or y0 >= y1:
+        return image
+    points, thickness = stroke_points(value, scale)
+    region = image[y0:y1, x0:x1]
+    opacity = value.get('opacity', 1)
+    layer = region if opacity >= 1 else region.copy()
+    cv2.polylines(layer, [points - [x0, y0]], False, tuple(value['color']), thickness, cv2.LINE_AA)
+    if opacity < 1:
+        cv2.addWeighted(layer, opacity, region, 1 - opacity, 0, dst=region)
+    return image
+
+
+def stroke(image, value, scale=1):
+    return draw_stroke(tiles.copy(image), value, scale)
+
+
+OPERATIONS = {
+    'average_blur': average_blur,
+    'gaussian_blur': gaussian_blur,
+    'median_blur': median_blur,
+    'brightness': brightness,
+    'saturation': saturation,
+    'adjust': adjust,
+    'curves': curves,
+    'lut_chain': lut_chain,
+    'negative': negative,
+    'black_and_white': black_and_white,
+    'stylisation': stylisation,
+    'sketch': sketch,
+    'emboss': emboss,
+    'sepia': sepia,
+    'binary_threshold': binary_threshold,
+    'erosion': erosion,
+    'dilation': dilation,
+    'rotate_left': rotate_left,
+    'rotate_right': rotate_right,
+    'flip_vertical': flip_vertical,
+    'flip_horizontal': flip_horizontal,
+    'rotate': rotate,
+    'crop': crop,
+    'text': text,
+    'draw': draw,
+    'stroke': stroke,
+}
+
+
+# Pixels of context an operation needs around any region of its output, in full-resolution
+# pixels. Sketch uses an edge-preserving recursive filter whose reach is unbounded, so its
+# footprint is three times the spatial sigma, past which the influence is negligible.
+# Stylisation normalises edge strength over the whole image, so it has no finite footprint.
+# Blurs reach half their kernel, plus a margin for the downscaled path of large Gaussians.
+def kernel_radius(value):
+    return odd_kernel(value) // 2
+
+
+FOOTPRINTS = {
+    'average_blur': kernel_radius,
+    'gaussian_blur': lambda value: blur.footprint(odd_kernel(value)),
+    'median_blur': kernel_radius,
+    'brightness': lambda value: 0,
+    'saturation': lambda value: 0,
+    'adjust': lambda value: 0,
+    'curves': lambda value: 0,
+    'lut_chain': lambda value: 0,
+    'negative': lambda value: 0,
+    'black_and_white': lambda value: 0,
+    'sketch': lambda value: 180,
+    'emboss': lambda value: 1,
+    'sepia': lambda value: 0,
+    'binary_threshold': lambda value: 0,
+    'erosion': lambda value: 2,
+    'dilation': lambda value: 2,
+}
+
+# Expensive neighbourhood operations that are split into bands across cores, with the largest
+# difference from a single call that is expected. Sketch's recursive filter rounds slightly
+# differently on bands of different heights. Stylisation is left out because it cannot be
+# split without seams (see FOOTPRINTS).
+PARALLEL = {
+    'median_blur': 0,
+    'sketch': 8,
+    'emboss': 0,
+}
+
+# Representative values for operations that take one, used by checks and benchmarks
+SAMPLE_VALUES = {
+    'average_blur': 31,
+    'gaussian_blur': 31,
+    'median_blur': 31,
+    'brightness': 1.3,
+    'saturation': 40,
+    'adjust': {'brightness': 1.1, 'contrast': 1.2, 'gamma': 0.9, 'shadows': 10, 'saturation': 1.3},
+    'curves': [[0, 0], [64, 48], [192, 208], [255, 255]],
+    # Fused from brightness, curves and negative (see fuse)
+    'lut_chain': [{'op': 'brightness', 'value': 1.3}, {'op': 'curves', 'value': [[0, 0], [64, 48], [192, 208], [255, 255]]},
+                  {'op': 'negative', 'value': None}],
+    'rotate': 30,
+}
+
+# Operations that only move pixels, as numpy views
+VIEWS = ('rotate_left', 'rotate_right', 'flip_vertical', 'flip_horizontal', 'crop')
+
+
+def make_step(name, value=None):
+    if name not in OPERATIONS:
+        raise ValueError(f"Unknown operation: {name}")
+    return {'op': name, 'value': value}
+
+
+def apply_step(image, step, scale=1, cache=None):
+    # With a ResultCache, results and shared intermediates are looked up before computing.
+    # Views cost nothing to make and tiled results live on disk, so neither is cached.
+    if step['op'] not in OPERATIONS:
+        raise ValueError(f"Unknown operation: {step['op']}")
+    if cache is None or step['op'] in VIEWS or tiles.is_tiled(image):
+        return compute_step(image, step, scale)
+    return cache.get_or_compute(cache.key(image, step['op'], step['value'], scale),
+                                partial(compute_step, image, step, scale, cache), source=image)
+
+
+def compute_step(image, step, scale=1, cache=None):
+    with tracing.span('op.' + step['op']):
+        if tiles.is_tiled(image):
+            return apply_tiled(image, step, scale)
+        if step['op'] in PARALLEL and image.shape[0] * image.shape[1] >= parallel.MIN_PIXELS:
+            return parallel.run_banded(operation(step, scale), image, footprint(step, scale), align=block(step, scale))
+        previous, ACTIVE.cache = getattr(ACTIVE, 'cache', None), cache
+        try:
+            return operation(step, scale)(image)
+        finally:
+            ACTIVE.cache = previous
+
+
+# The cache of the step being computed on this thread, through which operations share
+# intermediates such as the grayscale conversion of their source
+ACTIVE = threading.local()
+
+
+def intermediate(image, name, function):
+    cache = getattr(ACTIVE, 'cache', None)
+    if cache is None:
+        return function(image)
+    return cache.get_or_compute(cache.key(image, name), partial(function, image), source=image)
+
+
+def operation(step, scale=1):
+    return partial(OPERATIONS[step['op']], value=step['value'], scale=scale)
+
+
+def footprint(step, scale=1):
+    return int(math.ceil(FOOTPRINTS[step['op']](step['value']) / scale))
+
+
+def block(step, scale=1):
+    # Downscaled blurs average blocks of this many pixels, so a region they are run on must
+    # start on a multiple of it to give the same result as the whole image
+    if step['op'] == 'gaussian_blur':
+        return blur.reduction(odd_kernel(step['value'], scale))
+    return 1
+
+
+def apply_tiled(image, step, scale=1):
+    # Only steps whose tiles join up exactly are tiled (see is_local), so a large image gets
+    # the same pixels as one call on the whole image, which is what `batch` does
+    name, value = step['op'], step['value']
+    if is_local(step):
+        return tiles.map_tiles(image, operation(step, scale), footprint(step, scale), workers=parallel.WORKERS,
+                               align=block(step, scale))
+    image = OPERATIONS[name](image, value, scale=scale)
+    if not tiles.is_tiled(image):
+        image = tiles.materialize(image)
+    return image
+
+
+# Point operations: per-channel functions of the pixel value alone. Runs of them are fused
+# into one lookup table, which is exact because every step maps uint8 values to uint8 values.
+def point_lut(step):
+    name, value = step['op'], step['value']
+    if name in ('brightness', 'saturation', 'negative', 'binary_threshold'):
+        return color.lut_from(operation(step))
+    if name == 'curves':
+        return color.curve_lut(value)
+    if name == 'adjust' and value.get('saturation', 1) == 1:
+        return adjust_lut(value)
+    if name == 'lut_chain':
+        return chain_lut(value)
+    return None
+
+
+def chain_lut(steps):
+    lut = color.IDENTITY
+    for step in steps:
+        lut = color.compose(lut, point_lut(step))
+    return lut
+
+
+def fuse(steps):
+    group = []
+    for step in list(steps) + [None]:
+        if step is not None and point_lut(step) is not None:
+            group.append(step)
+            continue
+        if len(group) > 1:
+            yield make_step('lut_chain', group)
+        elif group:
+            yield group[0]
+        group = []
+        if step is not None:
+            yield step
+
+
+def is_view(step):
+    # Quarter turns, flips and crops only move whole pixels. Rotations by other angles
+    # resample, and are run one at a time on their whole input, because resampling a
+    # region, or two rotations composed into one, rounds differently from apply_step.
+    if step['op'] == 'rotate':
+        return float(step['value']) % 90 == 0
+    return step['op'] in geometry.OPERATIONS
+
+
+def is_local(step):
+    # Whether a region of the result can be computed from the region of the input around it
+    # exactly. Sketch is banded with small differences (see PARALLEL), and OpenCV's HSV
+    # conversion rounds differently depending on the row length.
+    if step['op'] not in FOOTPRINTS or PARALLEL.get(step['op']):
+        return False
+    return step['op'] != 'adjust' or step['value'].get('saturation', 1) == 1
+
+
+# Crops are pushed down: walking back from the last step, each step is given the box of its
+# input that the final result depends on. A crop or quarter turn narrows it to the pixels
+# it maps from, an operation with a footprint widens it by that much, and any other
+# operation, including a rotation by another angle, needs its whole input. Before each step
+# its input is cut to that box, which is a view. Boxes start on the block grid of
+# downscaled blurs (see block).
+def plan(steps, width, height, scale=1):
+    # Groups of consecutive quarter turns, flips and crops (as one transform) and single
+    # other steps, with the box of each group's input that is used and of the final output
+    groups = []
+    for step in fuse(steps):
+        if is_view(step) and groups and isinstance(groups[-1], list):
+            groups[-1].append(step)
+        else:
+            groups.append([step] if is_view(step) else step)
+    sizes = [(width, height)]
+    for group in groups:
+        if isinstance(group, list) or group['op'] in geometry.OPERATIONS:
+            sizes.append(geometry.compose(*sizes[-1], group if isinstance(group, list) else [group], scale).size)
+        else:
+            sizes.append(sizes[-1])
+    boxes = [(0, 0) + sizes[-1]]
+    for group, (width, height) in zip(reversed(groups), reversed(sizes[:-1])):
+        x0, y0, x1, y1 = boxes[0]
+        if isinstance(group, list):
+            x0, y0, x1, y1 = geometry.compose(width, height, group, scale).source_box(boxes[0])
+        elif is_local(group):
+            pad, align = footprint(group, scale), block(group, scale)
+            x0, y0 = (x0 - pad) // align * align, (y0 - pad) // align * align
+            x1, y1 = x1 + pad, y1 + pad
+        else:
+            x0, y0, x1, y1 = 0, 0, width, height
+        x0, y0, x1, y1 = max(0, x0), max(0, y0), min(width, x1), min(height, y1)
+        boxes.insert(0, (x0, y0, max(x0, x1), max(y0, y1)))
+    return groups, sizes, boxes
+
+
+def output_size(steps, width, height, scale=1):
+    return plan(steps, width, height, scale)[1][-1]
+
+
+def run(image, steps, scale=1):
+    source = image
+    groups, sizes, boxes = plan(steps, image.shape[1], image.shape[0], scale)
+    # Position of the image's top-left pixel in the full input of the current step
+    left = top = 0
+    for group, size, (x0, y0, x1, y1), output in zip(groups, sizes, boxes, boxes[1:]):
+        if (x0, y0, x1, y1) != (left, top, left + image.shape[1], top + image.shape[0]):
+            image = image[y0 - top:y1 - top, x0 - left:x1 - left]
+        left, top = x0, y0
+        if isinstance(group, list):
+            # One transform for the whole group, computing only the output box that is used
+            with tracing.span('op.geometry'):
+                transform = geometry.compose(*size, group, scale)
+                image = geometry.resolve(image, geometry.translated(transform, output, (x0, y0)))
+            left, top = output[:2]
+        elif (group['op'] == 'lut_chain' and image is not source and not tiles.is_tiled(image) and image.flags.writeable
+                and image.flags.c_contiguous and not np.may_share_memory(image, source)):
+            # The image was produced earlier in this run, so the fused table can overwrite it
+            with tracing.span('op.lut_chain'):
+                color.apply_lut(image, chain_lut(group['value']), out=image)
+        else:
+            image = apply_step(image, group, scale)
+    return image
+
+
+# Recipes
+def save_recipe(path, steps):
+    with open(path, 'w') as f:
+        json.dump({'version': RECIPE_VERSION, 'steps': list(steps)}, f, indent=2)
+
+
+def load_recipe(path):
+    # Recipes can use operations added by filter plugins
+    import filters
+    filters.load()
+    with open(path) as f:
+        recipe = json.load(f)
+    if recipe.get('version') != RECIPE_VERSION:
+        raise ValueError(f"Unsupported recipe version: {recipe.get('version')}")
+    for step in recipe['steps']:
+        make_step(step['op'], step.get('value'))
+    return recipe['steps']
+
+
+def synthetic_image(megapixels, seed=0):
+    # 4:3 test image with gradients, flat shapes and mild noise
+    rng = np.random.default_rng(seed)
+    width = max(1, int(math.sqrt(megapixels * 1e6 * 4 / 3)))
+    height = max(1, int(width * 3 / 4))
+    image = np.empty((height, width, 3), np.uint8)
+    image[..., 0] = np.arange(width) * 255 // max(1, width - 1)
+    image[..., 1] = (np.arange(height) * 255 // max(1, height - 1))[:, None]
+    image[..., 2] = 128
+    for _ in range(64):
+        center = (int(rng.integers(width)), int(rng.integers(height)))
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        cv2.circle(image, center, int(rng.integers(1, max(2, width // 8))), color, -1)
+    noise = rng.integers(0, 16, (min(height, 512), width, 3), dtype=np.uint8)
+    for y in range(0, height, noise.shape[0]):
+        band = image[y:y + noise.shape[0]]
+        cv2.add(band, noise[:band.shape[0]], dst=band)
+    return image
+
+
+def process_file(source, destination, steps):
+    start = time.perf_counter()
+    image = tiles.read_image(source)
+    if image is None:
+        raise ValueError(f"Failed to load image: {source}")
+    image = np.ascontiguousarray(image)
+    height, width = image.shape[:2]
+    image = run(image, steps)
+    if not cv2.imwrite(destination, image):
+        raise ValueError(f"Failed to write image: {destination}")
+    return width * height / 1e6, time.perf_counter() - start
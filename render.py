@@ -0,0 +1,91 @@
+import queue
+import threading
+
+import tracing
+
+
+class RenderScheduler:
+    # Runs render jobs on a single worker thread. Jobs are grouped by key: submitting a new
+    # job for a key replaces the queued one and makes any running one stale, so a dragged
+    # slider only ever renders its newest value. Results are handed back on the Tk thread
+    # by polling with master.after(), since Tk must not be touched from the worker.
+    def __init__(self, master, on_busy=None, poll_interval=15):
+        self.master = master
+        self.on_busy = on_busy
+        self.poll_interval = poll_interval
+        self.condition = threading.Condition()
+        self.generations = {}
+        self.pending = {}
+        self.running = None
+        self.results = queue.Queue()
+        self.polling = False
+        self.worker = threading.Thread(target=self.work, name="render-worker", daemon=True)
+        self.worker.start()
+
+    def submit(self, key, callback, function, *args, error_callback=None, **kwargs):
+        with self.condition:
+            generation = self.generations.get(key, 0) + 1
+            self.generations[key] = generation
+            self.pending.pop(key, None)
+            self.pending[key] = (generation, callback, error_callback, function, args, kwargs)
+            self.condition.notify()
+        if not self.polling:
+            self.polling = True
+            if self.on_busy:
+                self.on_busy(True)
+            self.master.after(self.poll_interval, self.poll)
+
+    def cancel(self, key):
+        with self.condition:
+            self.generations[key] = self.generations.get(key, 0) + 1
+            self.pending.pop(key, None)
+
+    def is_current(self, key, generation):
+        with self.condition:
+            return self.generations.get(key) == generation
+
+    def busy(self, key=None):
+        with self.condition:
+            if key is None:
+                return bool(self.pending) or self.running is not None
+            return key in self.pending or self.running == key
+
+    def work(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                key = next(iter(self.pending))
+                generation, callback, error_callback, function, args, kwargs = self.pending.pop(key)
+                self.running = key
+            try:
+                with tracing.span('render.' + key):
+                    result, error = function(*args, **kwargs), None
+            except Exception as e:
+                result, error = None, e
+            with self.condition:
+                # Queued before the job stops counting as running, so poll() always sees
+                # either one or the other and keeps polling until the result is handed back
+                if self.generations.get(key) == generation:
+                    self.results.put((key, generation, callback, error_callback, result, error))
+                self.running = None
+
+    def poll(self):
+        while True:
+            try:
+                key, generation, callback, error_callback, result, error = self.results.get_nowait()
+            except queue.Empty:
+                break
+            # A newer job for the same key may have been submitted while this one was queued
+            if not self.is_current(key, generation):
+                continue
+            if error is None:
+                callback(result)
+            elif error_callback:
+                error_callback(error)
+        if self.busy() or not self.results.empty():
+            self.master.after(self.poll_interval, self.poll)
+        else:
+            self.polling = False
+            if self.on_busy:
+                self.on_busy(False)
@@ -0,0 +1,56 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Modules timed on their own, each in a fresh interpreter; `app` is what the editor imports
+# before its window can appear
+MODULES = ('tkinter', 'numpy', 'cv2', 'PIL.ImageTk', 'pipeline', 'app')
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+def import_seconds(module, repeat):
+    code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+    times = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', code], cwd=DIRECTORY, capture_output=True, text=True, check=True)
+        times.append(float(output.stdout.split()[-1]))
+    return statistics.median(times)
+
+
+def window_seconds(repeat):
+    # Time from launching the editor until its window is mapped and until it is ready to load
+    # an image, or None without a display
+    environment = dict(os.environ, EDITOR_STARTUP_PROBE='1')
+    windows, readies = [], []
+    for _ in range(repeat):
+        launched = time.time()
+        output = subprocess.run([sys.executable, os.path.join(DIRECTORY, 'app.py')], cwd=DIRECTORY, env=environment,
+                                capture_output=True, text=True, timeout=60)
+        if output.returncode:
+            return None
+        times = json.loads(output.stdout.strip().splitlines()[-1])
+        if times['window'] is not None:
+            windows.append(times['window'] - launched)
+        readies.append(times['ready'] - launched)
+    return {'window': statistics.median(windows) if windows else None, 'ready': statistics.median(readies)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='app.py startup', description='Measure how long the editor takes to start.')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per measurement; the median is reported')
+    args = parser.parse_args(argv)
+
+    for module in MODULES:
+        print(f"import {module}: {import_seconds(module, args.repeat) * 1000:.0f} ms")
+    times = window_seconds(args.repeat)
+    if times is None:
+        print("window: skipped, Tk could not open a window (no display?)")
+        return 0
+    if times['window'] is not None:
+        print(f"window shown: {times['window'] * 1000:.0f} ms")
+    print(f"ready: {times['ready'] * 1000:.0f} ms")
+    return 0
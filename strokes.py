@@ -0,0 +1,37 @@
+from tkinter import ROUND
+
+CHUNK_POINTS = 64
+
+
+class Stroke:
+    # Live preview of a brush stroke on the canvas. Points are buffered into polyline items of
+    # at most CHUNK_POINTS points, and each motion event only updates the coordinates of the
+    # newest item, so the cost per event does not grow with the length of the stroke.
+    def __init__(self, canvas, fill, width, opacity=1):
+        self.canvas = canvas
+        self.fill = fill
+        self.width = width
+        # Tk canvas items have no alpha, so translucent brushes are previewed stippled
+        self.stipple = 'gray50' if opacity < 0.75 else ''
+        self.points = []
+        self.chunk = []
+        self.items = []
+
+    def add(self, x, y):
+        self.points.append((x, y))
+        self.chunk.extend((x, y))
+        if len(self.chunk) < 4:
+            return
+        if not self.items or len(self.chunk) > 2 * CHUNK_POINTS:
+            # Start the next item at the last point so the pieces join up
+            self.chunk = self.chunk[-4:]
+            self.items.append(self.canvas.create_line(*self.chunk, width=self.width, fill=self.fill, stipple=self.stipple,
+                                                      capstyle=ROUND, joinstyle=ROUND))
+        else:
+            self.canvas.coords(self.items[-1], *self.chunk)
+
+    def clear(self):
+        for item in self.items:
+            self.canvas.delete(item)
+        self.items = []
+        self.chunk = []
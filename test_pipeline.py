@@ -0,0 +1,83 @@
+import random
+
+import numpy as np
+import pytest
+
+import pipeline
+import tiles
+
+# pipeline.run composes, fuses and crops steps ahead of time; the result must be identical to
+# applying the steps one by one, which is what the editor shows
+CHAINS = [
+    [('crop', [400, 300, 800, 700]), ('rotate', 20)],
+    [('rotate', 30), ('rotate', -30)],
+    [('rotate', 12), ('crop', [50, 40, 300, 200])],
+    [('crop', [100, 80, 500, 400]), ('rotate', 25), ('negative', None)],
+    [('gaussian_blur', 31), ('rotate', 30), ('crop', [50, 40, 300, 200])],
+    [('rotate_left', None), ('flip_horizontal', None), ('rotate', 90), ('crop', [10, 20, 300, 250])],
+    [('adjust', {'brightness': 1.1, 'saturation': 1.3}), ('crop', [235, 95, 513, 310])],
+    [('brightness', 1.3), ('curves', [[0, 0], [64, 48], [192, 208], [255, 255]]), ('negative', None), ('crop', [5, 5, 200, 300])],
+    [('median_blur', 9), ('emboss', None), ('crop', [101, 37, 403, 299]), ('sketch', None), ('crop', [20, 20, 120, 90])],
+    [('gaussian_blur', 151), ('crop', [123, 77, 411, 300])],
+]
+
+
+def apply_steps(image, steps):
+    for step in steps:
+        image = pipeline.apply_step(image, step)
+    return image
+
+
+@pytest.fixture(scope='module')
+def image():
+    return pipeline.synthetic_image(0.3)
+
+
+@pytest.mark.parametrize('chain', CHAINS, ids=lambda chain: '-'.join(name for name, value in chain))
+def test_run_matches_apply_step(image, chain):
+    steps = [pipeline.make_step(name, value) for name, value in chain]
+    assert np.array_equal(pipeline.run(image, steps), apply_steps(image, steps))
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_random_chains(image, seed):
+    rng = random.Random(seed)
+    height, width = image.shape[:2]
+    names = ['rotate_left', 'rotate_right', 'flip_vertical', 'flip_horizontal', 'crop', 'rotate', 'gaussian_blur',
+             'median_blur', 'average_blur', 'emboss', 'negative', 'brightness', 'adjust', 'erosion', 'sepia']
+    steps = []
+    for _ in range(rng.randint(1, 6)):
+        name = rng.choice(names)
+        if name == 'crop':
+            x0, y0 = rng.randint(0, width // 2), rng.randint(0, height // 2)
+            value = [x0, y0, x0 + rng.randint(20, width), y0 + rng.randint(20, height)]
+        elif name == 'rotate':
+            value = rng.choice([-30, 12, 45, 90, 180])
+        elif name.endswith('_blur'):
+            value = rng.choice([3, 9, 31, 101])
+        else:
+            value = pipeline.SAMPLE_VALUES.get(name)
+        steps.append(pipeline.make_step(name, value))
+    assert np.array_equal(pipeline.run(image, steps), apply_steps(image, steps))
+
+
+@pytest.mark.parametrize('name', ['rotate_left', 'rotate_right', 'flip_vertical', 'flip_horizontal', 'crop'])
+def test_stroke_on_view(image, name):
+    # The editor draws strokes in place, on whatever the last step returned
+    step = pipeline.make_step(name, [10, 20, 300, 250] if name == 'crop' else None)
+    stroke = pipeline.make_step('stroke', {'points': [[10, 10], [100, 80], [30, 150]], 'color': [0, 255, 0], 'size': 7,
+                                           'opacity': 0.6})
+    view = pipeline.apply_step(image.copy(), step)
+    drawn = pipeline.drawable(view)
+    pipeline.draw_stroke(drawn, stroke['value'])
+    assert np.array_equal(drawn, pipeline.apply_step(pipeline.apply_step(image, step), stroke))
+
+
+@pytest.mark.parametrize('chain', [[('sketch', None)], [('adjust', {'brightness': 1.1, 'saturation': 1.3})],
+                                   [('gaussian_blur', 99), ('emboss', None), ('rotate', 12)]],
+                         ids=lambda chain: '-'.join(name for name, value in chain))
+def test_tiled_matches_whole_image(chain):
+    # The editor tiles large images; batch processes them whole
+    image = pipeline.synthetic_image(1.5)
+    steps = [pipeline.make_step(name, value) for name, value in chain]
+    assert np.array_equal(np.asarray(apply_steps(tiles.materialize(image), steps)), apply_steps(image, steps))
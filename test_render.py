@@ -0,0 +1,72 @@
+import queue
+import threading
+import time
+
+from render import RenderScheduler
+
+
+class Master:
+    # Stands in for the Tk root: after() callbacks run when run() is called
+    def __init__(self):
+        self.callbacks = []
+
+    def after(self, milliseconds, callback):
+        self.callbacks.append(callback)
+
+    def run(self, seconds=2):
+        end = time.time() + seconds
+        while self.callbacks and time.time() < end:
+            self.callbacks.pop(0)()
+            time.sleep(0.001)
+
+
+class SlowQueue(queue.Queue):
+    # Takes a while to queue each result, so poll() runs while the worker is handing one back
+    def __init__(self):
+        super().__init__()
+        self.putting = threading.Event()
+
+    def put(self, item, *args, **kwargs):
+        self.putting.set()
+        time.sleep(0.1)
+        super().put(item, *args, **kwargs)
+
+
+def test_result_is_delivered():
+    master = Master()
+    scheduler = RenderScheduler(master)
+    results = []
+    scheduler.submit('apply', results.append, lambda value: value * 2, 21)
+    master.run()
+    assert results == [42]
+    assert not scheduler.polling
+
+
+def test_result_handed_back_while_polling():
+    master = Master()
+    scheduler = RenderScheduler(master)
+    scheduler.results = SlowQueue()
+    results = []
+    scheduler.submit('apply', results.append, lambda value: value * 2, 21)
+    assert scheduler.results.putting.wait(2)
+    master.run()
+    assert results == [42]
+    assert not scheduler.polling
+
+
+def test_stale_result_is_dropped():
+    master = Master()
+    scheduler = RenderScheduler(master)
+    results = []
+    started = threading.Event()
+
+    def slow(value):
+        started.set()
+        time.sleep(0.1)
+        return value
+
+    scheduler.submit('preview', results.append, slow, 1)
+    assert started.wait(2)
+    scheduler.submit('preview', results.append, slow, 2)
+    master.run()
+    assert results == [2]
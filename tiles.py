@@ -0,0 +1,176 @@
+import os
+import struct
+import tempfile
+import zlib
+
+import cv2
+import numpy as np
+from PIL import Image
+
+import parallel
+
+TILE_SIZE = 1024
+SCRATCH_DIR = os.environ.get('EDITOR_SCRATCH_DIR')
+
+
+# Large images live in memory-mapped scratch files instead of RAM. Every slice or view of
+# one is still an np.memmap, which is how the rest of the editor recognises them.
+def is_tiled(image):
+    return isinstance(image, np.memmap)
+
+
+def scratch(shape, dtype=np.uint8):
+    if int(np.prod(shape)) == 0:
+        return np.empty(shape, dtype)
+    f = tempfile.NamedTemporaryFile(prefix='editor-', suffix='.raw', dir=SCRATCH_DIR, delete=False)
+    try:
+        image = np.memmap(f, dtype=dtype, mode='w+', shape=shape)
+    finally:
+        f.close()
+    try:
+        # The mapping keeps the data alive, so the file disappears once the image is freed
+        os.remove(f.name)
+    except OSError:
+        pass
+    return image
+
+
+def tiles(height, width, tile_size=TILE_SIZE):
+    for y in range(0, height, tile_size):
+        for x in range(0, width, tile_size):
+            yield y, x, min(y + tile_size, height), min(x + tile_size, width)
+
+
+def map_tiles(image, function, overlap, tile_size=TILE_SIZE, workers=1, align=1):
+    # Runs `function` tile by tile with `overlap` pixels of context on every side, which makes
+    # the result identical to one call on the whole image for operations whose footprint is
+    # within the overlap. Borders are left to the operation, as the image edge is a tile edge.
+    # Every tile with its context starts on a multiple of `align` (which must divide the tile
+    # size), for operations that work on blocks of pixels.
+    # With several workers, at most two tiles per worker are held in memory at once.
+    height, width = image.shape[:2]
+    out = scratch(image.shape, image.dtype)
+    overlap = -(-overlap // align) * align
+
+    def process_tile(y0, x0, y1, x1):
+        top, left = max(0, y0 - overlap), max(0, x0 - overlap)
+        bottom, right = min(height, y1 + overlap), min(width, x1 + overlap)
+        result = function(np.ascontiguousarray(image[top:bottom, left:right]))
+        out[y0:y1, x0:x1] = result[y0 - top:y1 - top, x0 - left:x1 - left]
+
+    if workers <= 1:
+        for tile in tiles(height, width, tile_size):
+            process_tile(*tile)
+        return out
+    executor = parallel.get_executor('thread', workers)
+    in_flight = []
+    for tile in tiles(height, width, tile_size):
+        in_flight.append(executor.submit(process_tile, *tile))
+        if len(in_flight) >= 2 * workers:
+            in_flight.pop(0).result()
+    for future in in_flight:
+        future.result()
+    return out
+
+
+def materialize(view, tile_size=TILE_SIZE, cancelled=None):
+    # Copies a (possibly strided) view into a new scratch image one tile at a time. Returns
+    # None if the `cancelled` event is set before the copy is done.
+    out = scratch(view.shape, view.dtype)
+    for y0, x0, y1, x1 in tiles(view.shape[0], view.shape[1], tile_size):
+        if cancelled is not None and cancelled.is_set():
+            return None
+        out[y0:y1, x0:x1] = view[y0:y1, x0:x1]
+    return out
+
+
+def copy(image):
+    if is_tiled(image):
+        return materialize(image)
+    return image.copy()
+
+
+# Loading
+REDUCED = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+# Views that turn stored pixels upright for each EXIF orientation
+ORIENTATIONS = {
+    2: lambda image: image[:, ::-1],
+    3: lambda image: image[::-1, ::-1],
+    4: lambda image: image[::-1],
+    5: lambda image: image.swapaxes(0, 1),
+    6: lambda image: np.rot90(image, -1),
+    7: lambda image: image[::-1, ::-1].swapaxes(0, 1),
+    8: lambda image: np.rot90(image),
+}
+
+
+def read_header(path):
+    # (width, height, format, orientation) from the file header alone, with the size already
+    # turned upright; (None, None, None, 1) for files Pillow cannot identify
+    try:
+        with Image.open(path) as image:
+            width, height = image.size
+            orientation = image.getexif().get(0x0112, 1)
+            file_format = image.format
+    except Exception:
+        return None, None, None, 1
+    if orientation in (5, 6, 7, 8):
+        width, height = height, width
+    return width, height, file_format, orientation
+
+
+def read_image(path, reduction=1, orientation=None):
+    # Decodes at 1/reduction of the size (2, 4 or 8; JPEG decodes these directly from the
+    # DCT) and turns the pixels upright. The result may be a strided view.
+    image = cv2.imread(path, REDUCED.get(reduction, cv2.IMREAD_COLOR) | cv2.IMREAD_IGNORE_ORIENTATION)
+    if image is None:
+        return None
+    if orientation is None:
+        orientation = read_header(path)[3]
+    return ORIENTATIONS.get(orientation, lambda image: image)(image)
+
+
+def load_image(path, tiled_pixels, cancelled=None):
+    # OpenCV can only decode the whole file at once, so the decoded frame is moved into a
+    # scratch file, turned upright on the way, and released; from then on only touched tiles
+    # occupy RAM.
+    image = read_image(path)
+    if image is None:
+        return None
+    if image.shape[0] * image.shape[1] < tiled_pixels:
+        return np.ascontiguousarray(image)
+    return materialize(image, cancelled=cancelled)
+
+
+def png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+
+def write_png(path, image, rows=256, level=3):
+    # Encodes 8-bit BGR(A) images a band of rows at a time, so only one band is ever decoded
+    height, width = image.shape[:2]
+    channels = 1 if image.ndim == 2 else image.shape[2]
+    color_type = {1: 0, 3: 2, 4: 6}[channels]
+    compressor = zlib.compressobj(level)
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, color_type, 0, 0, 0)))
+        for y in range(0, height, rows):
+            band = np.asarray(image[y:y + rows]).reshape(-1, width, channels)
+            if channels >= 3:
+                band = band[..., [2, 1, 0] + list(range(3, channels))]
+            band = band.reshape(band.shape[0], -1)
+            # "Sub" filter: each byte minus the same channel of the previous pixel
+            filtered = band.copy()
+            filtered[:, channels:] -= band[:, :-channels]
+            rows_data = np.empty((band.shape[0], band.shape[1] + 1), np.uint8)
+            rows_data[:, 0] = 1
+            rows_data[:, 1:] = filtered
+            data = compressor.compress(rows_data.tobytes())
+            if data:
+                f.write(png_chunk(b'IDAT', data))
+        f.write(png_chunk(b'IDAT', compressor.flush()))
+        f.write(png_chunk(b'IEND', b''))
+    return True
+
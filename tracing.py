@@ -0,0 +1,132 @@
+import atexit
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+
+# EDITOR_TRACE=1 turns tracing on; any other value is also the file the trace is written to on exit
+TRACE = os.environ.get('EDITOR_TRACE', '')
+
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span:
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.record(self.name, self.start, time.perf_counter())
+        return False
+
+
+class Tracer:
+    # Records named spans as Chrome trace events and keeps the last `window` durations of each
+    # name for latency histograms. When disabled, span() hands out a shared no-op span.
+    def __init__(self, enabled=False, window=1000, max_events=200000):
+        self.enabled = enabled
+        self.origin = time.perf_counter()
+        self.events = deque(maxlen=max_events)
+        self.durations = defaultdict(lambda: deque(maxlen=window))
+        self.last = {}
+        self.threads = {}
+        self.lock = threading.Lock()
+
+    def span(self, name):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name)
+
+    def record(self, name, start, end):
+        thread = threading.current_thread()
+        with self.lock:
+            self.threads[thread.ident] = thread.name
+            self.events.append({'name': name, 'cat': name.split('.')[0], 'ph': 'X', 'pid': os.getpid(), 'tid': thread.ident,
+                                'ts': (start - self.origin) * 1e6, 'dur': (end - start) * 1e6})
+            self.durations[name].append(end - start)
+            # The latest span of each category ("FrontEnd", "op", "display", ...) for the status bar
+            self.last[name.split('.')[0]] = (name, end - start)
+
+    def latest(self, categories):
+        with self.lock:
+            return [self.last[category] for category in categories if category in self.last]
+
+    def names(self):
+        # Other threads record while this runs, so the keys are copied under the lock
+        with self.lock:
+            return sorted(self.durations)
+
+    def stats(self, name):
+        with self.lock:
+            samples = sorted(self.durations.get(name, ()))
+        if not samples:
+            return None
+
+        def percentile(p):
+            return samples[min(len(samples) - 1, int(p * len(samples)))]
+        return {'count': len(samples), 'p50': percentile(0.5), 'p90': percentile(0.9), 'p99': percentile(0.99),
+                'max': samples[-1]}
+
+    def histogram(self, name):
+        # Counts of recent durations in power-of-two millisecond buckets: "<1 ms", "<2 ms", ...
+        buckets = defaultdict(int)
+        with self.lock:
+            samples = list(self.durations.get(name, ()))
+        for seconds in samples:
+            limit = 1
+            while seconds * 1000 >= limit:
+                limit *= 2
+            buckets[f"<{limit} ms"] += 1
+        return dict(buckets)
+
+    def summary(self):
+        lines = []
+        for name in self.names():
+            stats = self.stats(name)
+            if stats:
+                lines.append(f"{name}: n={stats['count']} p50={stats['p50'] * 1000:.1f} ms p90={stats['p90'] * 1000:.1f} ms "
+                             f"p99={stats['p99'] * 1000:.1f} ms max={stats['max'] * 1000:.1f} ms")
+        return '\n'.join(lines)
+
+    def export(self, path):
+        with self.lock:
+            events = list(self.events)
+            threads = dict(self.threads)
+        for ident, thread_name in threads.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': ident, 'args': {'name': thread_name}})
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms',
+                       'otherData': {'histograms': {name: self.histogram(name) for name in self.names()}}}, f)
+
+
+TRACER = Tracer(enabled=bool(TRACE))
+
+
+def span(name):
+    return TRACER.span(name)
+
+
+def traced(name, function):
+    def wrapper(*args, **kwargs):
+        with TRACER.span(name):
+            return function(*args, **kwargs)
+    wrapper.__name__ = getattr(function, '__name__', name)
+    return wrapper
+
+
+if TRACE and TRACE != '1':
+    atexit.register(TRACER.export, TRACE)
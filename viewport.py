@@ -0,0 +1,165 @@
+import math
+from collections import OrderedDict
+
+import cv2
+
+import tracing
+
+
+class Pyramid:
+    # Mipmap levels of one image, built on first use: level k averages 2**k x 2**k blocks of
+    # level 0. `scale` is the number of full-resolution pixels per level-0 pixel (above 1 for
+    # preview proxies). Every level is computed from level 0 directly, so after an edit the
+    # blocks covering the changed region can be recomputed without touching the rest.
+    def __init__(self, image, scale=1):
+        self.image = image
+        self.scale = scale
+        self.levels = {0: image}
+
+    def depth(self):
+        # Index of the coarsest level that is still at least one pixel in each direction
+        return max(0, min(self.image.shape[:2]).bit_length() - 1)
+
+    def level(self, k):
+        if k not in self.levels:
+            height, width = self.image.shape[0] >> k, self.image.shape[1] >> k
+            with tracing.span('display.pyramid'):
+                self.levels[k] = self.downscale(k, 0, 0, width, height)
+        return self.levels[k]
+
+    def downscale(self, k, x0, y0, x1, y1):
+        # Exact 2**k downscale of a block-aligned region, in level-k coordinates
+        source = self.image[y0 << k:y1 << k, x0 << k:x1 << k]
+        return cv2.resize(source, (x1 - x0, y1 - y0), interpolation=cv2.INTER_AREA)
+
+    def invalidate(self, box):
+        # Recomputes the blocks of every built level that overlap box = (x0, y0, x1, y1), given
+        # in level-0 pixels, after the image was changed in place
+        x0, y0, x1, y1 = box
+        for k, level in self.levels.items():
+            if not k:
+                continue
+            height, width = level.shape[:2]
+            kx0, ky0 = max(0, x0 >> k), max(0, y0 >> k)
+            kx1, ky1 = min(width, -(-x1 >> k)), min(height, -(-y1 >> k))
+            if kx0 < kx1 and ky0 < ky1:
+                level[ky0:ky1, kx0:kx1] = self.downscale(k, kx0, ky0, kx1, ky1)
+
+
+class PyramidCache:
+    # Pyramids of the last few images shown, so switching between the edited image, the
+    # filtered image and a preview does not rebuild levels. The cache holds a reference to
+    # each image, so an id() cannot be reused while its entry exists.
+    def __init__(self, size=4):
+        self.size = size
+        self.pyramids = OrderedDict()
+
+    def get(self, image, scale=1):
+        key = (id(image), scale)
+        pyramid = self.pyramids.pop(key, None)
+        if pyramid is None or pyramid.image is not image:
+            pyramid = Pyramid(image, scale)
+        self.pyramids[key] = pyramid
+        while len(self.pyramids) > self.size:
+            self.pyramids.popitem(last=False)
+        return pyramid
+
+    def update(self, old, image, box):
+        # `image` is `old` with only `box` changed, either in place or in a copy. A copy takes
+        # over the built levels of the old pyramid, so only the changed blocks are recomputed.
+        for key, pyramid in list(self.pyramids.items()):
+            if pyramid.image is not old or old.shape != image.shape:
+                continue
+            if image is not old:
+                pyramid = Pyramid(image, pyramid.scale)
+                pyramid.levels.update({k: level.copy() for k, level in self.pyramids[key].levels.items() if k})
+                self.pyramids[(id(image), pyramid.scale)] = pyramid
+            pyramid.invalidate(box)
+        while len(self.pyramids) > self.size:
+            self.pyramids.popitem(last=False)
+
+    def clear(self):
+        self.pyramids.clear()
+
+
+class Viewport:
+    # Maps canvas pixels to full-resolution image pixels: a canvas point (x, y) shows image
+    # point (left + x / zoom, top + y / zoom). The canvas is sized to fit the whole image;
+    # zooming in shows part of it.
+    def __init__(self, max_width, max_height, max_zoom=16):
+        self.max_width = max_width
+        self.max_height = max_height
+        self.max_zoom = max_zoom
+        self.image_size = None
+        self.width = max_width
+        self.height = max_height
+        self.fit_zoom = self.zoom = 1
+        self.left = self.top = 0
+
+    def fit(self, width, height):
+        # Shows the whole image, never enlarged; the zoom and position are kept while the image
+        # size stays the same. Returns whether the canvas size changed. An empty image is not
+        # shown and leaves the view as it was.
+        if self.image_size == (width, height) or width < 1 or height < 1:
+            return False
+        self.image_size = (width, height)
+        self.fit_zoom = min(1, self.max_width / width, self.max_height / height)
+        self.width = max(1, int(width * self.fit_zoom))
+        self.height = max(1, int(height * self.fit_zoom))
+        self.reset()
+        return True
+
+    def clear(self):
+        self.image_size = None
+
+    def reset(self):
+        self.zoom = self.fit_zoom
+        self.left = self.top = 0
+
+    def to_image(self, x, y):
+        width, height = self.image_size
+        return (min(max(int(self.left + x / self.zoom), 0), width),
+                min(max(int(self.top + y / self.zoom), 0), height))
+
+    def zoom_at(self, factor, x, y):
+        # Zooms by `factor` keeping the image point under canvas point (x, y) in place
+        zoom = min(max(self.zoom * factor, self.fit_zoom), self.max_zoom)
+        self.left += x / self.zoom - x / zoom
+        self.top += y / self.zoom - y / zoom
+        self.zoom = zoom
+        self.clamp()
+
+    def pan(self, dx, dy):
+        self.left -= dx / self.zoom
+        self.top -= dy / self.zoom
+        self.clamp()
+
+    def clamp(self):
+        width, height = self.image_size
+        self.left = min(max(self.left, 0), max(0, width - self.width / self.zoom))
+        self.top = min(max(self.top, 0), max(0, height - self.height / self.zoom))
+
+    def level_for(self, pyramid):
+        # Coarsest level that still has at least one pixel per canvas pixel
+        pixels = 1 / (self.zoom * pyramid.scale)
+        return min(pyramid.depth(), int(math.floor(math.log2(pixels)))) if pixels > 1 else 0
+
+    def render(self, pyramid):
+        # The visible part of the image as an RGB array at canvas resolution, and the canvas
+        # position of its top-left corner. Only the visible pixels of one level are resized.
+        k = self.level_for(pyramid)
+        level = pyramid.level(k)
+        size = pyramid.scale * 2 ** k  # Full-resolution pixels per level pixel
+        height, width = level.shape[:2]
+        x0, y0 = max(0, int(self.left / size)), max(0, int(self.top / size))
+        x1 = min(width, int(math.ceil((self.left + self.width / self.zoom) / size)))
+        y1 = min(height, int(math.ceil((self.top + self.height / self.zoom) / size)))
+        factor = size * self.zoom
+        left, top = (x0 * size - self.left) * self.zoom, (y0 * size - self.top) * self.zoom
+        out_width = max(1, int(round((x1 - x0) * factor)))
+        out_height = max(1, int(round((y1 - y0) * factor)))
+        with tracing.span('display.resize'):
+            region = cv2.resize(level[y0:y1, x0:x1], (out_width, out_height),
+                                interpolation=cv2.INTER_AREA if factor < 1 else cv2.INTER_NEAREST)
+        with tracing.span('display.cvtColor'):
+            return cv2.cvtColor(region, cv2.COLOR_BGR2RGB), (left, top)